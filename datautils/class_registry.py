@@ -0,0 +1,88 @@
+import json
+import os
+from typing import Dict
+
+from datautils.dataset_enum import DatasetType, get_dataset_enum
+from datautils.manifest import get_manifest, scan_dirs
+import utils.logger as logging
+
+# one registry per dataset and process. DataLoader workers are forked after the datasets
+# are built, so they share the mapping without reading the file again
+_registries: Dict[str, Dict[str, int]] = {}
+
+
+def get_dataset_glob(args, dataset):
+    """Returns the glob pattern matching every image of the dataset's folder layout."""
+    dir = args.dataset_dir + "/" + get_dataset_enum(dataset)
+
+    if dataset in [DatasetType.IMAGENET.value, DatasetType.CHEST_XRAY.value]:
+        return dir + '/train/*/*'
+
+    elif dataset == DatasetType.CIFAR10.value:
+        return args.dataset_dir + '/cifar10v2/train/*/*'
+
+    elif dataset in [DatasetType.UCMERCED.value]:
+        return dir + '/images/*/*'
+
+    elif dataset == DatasetType.MODERN_OFFICE_31.value:
+        return dir + '/*/*/*'
+
+    return dir + '/*/*'
+
+
+def build_class_index(args, dataset):
+    # the label of an image is the name of its parent folder, which the manifest already sorted
+    labels = get_manifest(get_dataset_glob(args, dataset), args.model_misc_path).class_names
+
+    return {label: index for index, label in enumerate(labels)}
+
+
+def load_class_index(out, pattern):
+    """Returns the saved class index, or None if it is missing or the class folders changed since."""
+    try:
+        with open(out) as file:
+            saved = json.load(file)
+
+    except (IOError, ValueError):
+        return None
+
+    # like the manifest, the index is stale as soon as a scanned directory was modified
+    dirs, mtimes = scan_dirs(pattern)
+    if "classes" not in saved or saved.get("dirs") != dirs or saved.get("dir_mtimes") != mtimes.tolist():
+        logging.info(f"Class index {out} is out of date, rebuilding it")
+        return None
+
+    return saved["classes"]
+
+
+def get_class_index(args, dataset=None) -> Dict[str, int]:
+    """
+    Returns the label -> index mapping of the dataset. It is built once from the directory
+    layout, persisted in model_misc_path with the mtimes of the scanned directories, rebuilt
+    when one of them changes and reused by every dataset of the process.
+    """
+    dataset = args.target_dataset if dataset is None else dataset
+    name = get_dataset_enum(dataset)
+
+    if name in _registries:
+        return _registries[name]
+
+    pattern = get_dataset_glob(args, dataset)
+    out = os.path.join(args.model_misc_path, f"{name}_classes.json")
+
+    class_index = load_class_index(out, pattern)
+    if class_index is None:
+        class_index = build_class_index(args, dataset)
+        dirs, mtimes = scan_dirs(pattern)
+
+        try:
+            with open(out, "w") as file:
+                json.dump({"classes": class_index, "dirs": dirs, "dir_mtimes": mtimes.tolist()}, file)
+
+            logging.info(f"class index of {len(class_index)} labels saved at {out}")
+
+        except IOError as er:
+            logging.error(er)
+
+    _registries[name] = class_index
+    return class_index
@@ -0,0 +1,175 @@
+import argparse
+import multiprocessing
+import os
+from functools import partial
+from typing import Dict
+
+import numpy as np
+import torch
+from PIL import Image
+from tqdm import tqdm
+
+from datautils.lmdb_dataset import LMDBDataset, LMDBStore, get_lmdb_store
+from datautils.manifest import DEFAULT_CACHE_DIR, covers_dir, decode_strings, encode_strings, get_manifest
+import utils.logger as logging
+
+DATA_FILE = "images.u8"
+INDEX_FILE = "index.npz"
+
+# stores already opened by this process, keyed by their directory
+_stores: Dict[str, "ImageStore"] = {}
+
+
+class ImageStore():
+    """
+    Read-only store of images decoded once and resized to a maximum side length. The pixels of
+    every image live in a single memory-mapped uint8 file, so workers share the pages through
+    the OS page cache and no JPEG is decoded in the training loop.
+    """
+
+    def __init__(self, dir) -> None:
+        self.dir = dir
+
+        with np.load(os.path.join(dir, INDEX_FILE)) as index:
+            self.paths = decode_strings(index["paths"])
+            self.labels = index["labels"]
+            self.offsets = index["offsets"]
+            self.heights = index["heights"]
+            self.widths = index["widths"]
+            self.max_side = int(index["max_side"])
+
+        self.path_index = {path: i for i, path in enumerate(self.paths)}
+        self.data = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self.path_index
+
+    def covers(self, dir, cache_dir=DEFAULT_CACHE_DIR):
+        return covers_dir(self.paths, dir, cache_dir)
+
+    def get_data(self):
+        # opened lazily so that every DataLoader worker maps the file after the fork
+        if self.data is None:
+            self.data = np.memmap(os.path.join(self.dir, DATA_FILE), dtype=np.uint8, mode="r")
+
+        return self.data
+
+    def get(self, index):
+        start, h, w = self.offsets[index], self.heights[index], self.widths[index]
+        pixels = self.get_data()[start: start + h * w * 3].reshape(h, w, 3)
+
+        return Image.fromarray(np.array(pixels), "RGB")
+
+    def load(self, path):
+        return self.get(self.path_index[path])
+
+
+class ImageStoreDataset(torch.utils.data.Dataset):
+    """Map-style (image, label) dataset over a compiled store, in place of an ImageFolder."""
+
+    def __init__(self, store: ImageStore, transform=None) -> None:
+        self.store = store
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, index):
+        img = self.store.get(index)
+        if self.transform is not None:
+            img = self.transform(img)
+
+        return img, int(self.store.labels[index])
+
+
+def get_image_store(args):
+    """Returns the compiled store set by image_store_dir in the config, or None if unset."""
+    if not args.image_store_dir:
+        return None
+
+    if args.image_store_dir not in _stores:
+        _stores[args.image_store_dir] = ImageStore(args.image_store_dir)
+        logging.info(f"Using the compiled image store at {args.image_store_dir}")
+
+    return _stores[args.image_store_dir]
+
+
+def get_image_source(args):
+    """
+    Returns where the datasets read their pixels from instead of decoding the image files:
+    the compiled image store if set, else the LMDB dataset, else None.
+    """
+    image_store = get_image_store(args)
+    return image_store if image_store is not None else get_lmdb_store(args)
+
+
+def get_source_dataset(source, transform=None):
+    if isinstance(source, LMDBStore):
+        return LMDBDataset(source, transform=transform)
+
+    return ImageStoreDataset(source, transform=transform)
+
+
+def decode_worker(path, max_side):
+    try:
+        img = Image.open(path)
+        img.draft("RGB", (max_side, max_side))
+        img = img.convert("RGB")
+        img.thumbnail((max_side, max_side), Image.BILINEAR)
+
+    except (IOError, SyntaxError):
+        return None
+
+    return np.asarray(img, dtype=np.uint8)
+
+
+def compile_image_store(pattern, out, max_side=256, n_worker=8, cache_dir="save/misc"):
+    """Decodes every image matched by pattern into a memory-mapped store at out."""
+    manifest = get_manifest(pattern, cache_dir)
+    os.makedirs(out, exist_ok=True)
+
+    kept, offsets, heights, widths = [], [], [], []
+
+    decode_fn = partial(decode_worker, max_side=max_side)
+    offset = 0
+    with open(os.path.join(out, DATA_FILE), "wb") as file, multiprocessing.Pool(n_worker) as pool:
+        for i, pixels in enumerate(tqdm(pool.imap(decode_fn, manifest.paths, chunksize=64), total=len(manifest))):
+            if pixels is None:
+                logging.warn(f"Skipping {manifest.paths[i]}, it could not be decoded")
+                continue
+
+            kept.append(i)
+            offsets.append(offset)
+            heights.append(pixels.shape[0])
+            widths.append(pixels.shape[1])
+
+            file.write(pixels.tobytes())
+            offset += pixels.size
+
+    np.savez(
+        os.path.join(out, INDEX_FILE),
+        paths=encode_strings([manifest.paths[i] for i in kept]),
+        labels=manifest.labels[kept],
+        offsets=np.array(offsets, dtype=np.int64),
+        heights=np.array(heights, dtype=np.int32),
+        widths=np.array(widths, dtype=np.int32),
+        max_side=np.array(max_side),
+    )
+
+    logging.info(f"{len(kept)} images ({offset / 1024 ** 3:.2f} GB) compiled into {out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode a dataset once into a memory-mapped image store")
+    parser.add_argument("--out", type=str, help="directory of the compiled store")
+    parser.add_argument("--max_side", type=int, default=256, help="maximum side length of the stored images")
+    parser.add_argument("--n_worker", type=int, default=8, help="number of workers decoding the images")
+    parser.add_argument("--cache_dir", type=str, default="save/misc", help="directory of the dataset manifests")
+    parser.add_argument("pattern", type=str, help="glob pattern of the images, e.g. './datasets/ham10000/*/*'")
+
+    args = parser.parse_args()
+
+    compile_image_store(args.pattern, args.out, args.max_side, args.n_worker, args.cache_dir)
@@ -5,9 +5,10 @@ from torch.utils.data import random_split
 import torchvision.datasets as datasets
 import torchvision.transforms as transforms
 from datautils.dataset_enum import DatasetType
+from datautils.image_store import get_image_source, get_source_dataset
 from models.active_learning.pretext_dataloader import PretextDataLoader
 
-from models.utils.commons import get_params, split_dataset
+from models.utils.commons import get_params, split_dataset, split_dataset2
 from models.utils.training_type_enum import TrainingType
 
 class LCDataset():
@@ -27,6 +28,10 @@ class LCDataset():
                 normalize,
             ])
 
+        image_source = get_image_source(self.args)
+        if image_source is not None and image_source.covers(self.dir, self.args.model_misc_path):
+            return split_dataset2(get_source_dataset(image_source, transform), ratio=0.8, is_classifier=True)
+
         return split_dataset(self.args, self.dir, transform, ratio=0.8, is_classifier=True)
 
     def get_loader(self, pretrain_data=None):
@@ -0,0 +1,140 @@
+import os
+from io import BytesIO
+from typing import Dict
+
+import lmdb
+import numpy as np
+import torch
+from PIL import Image
+
+from datautils.manifest import DEFAULT_CACHE_DIR, covers_dir
+import utils.logger as logging
+
+# stores already opened by this process, keyed by their path and resolution
+_stores: Dict[str, "LMDBStore"] = {}
+
+
+def get_image_key(resolution, index):
+    return f"{resolution}-{str(index).zfill(5)}".encode("utf-8")
+
+
+def get_label_key(index):
+    return f"label-{str(index).zfill(5)}".encode("utf-8")
+
+
+def get_path_key(index):
+    return f"path-{str(index).zfill(5)}".encode("utf-8")
+
+
+def open_env(path):
+    return lmdb.open(
+        path,
+        max_readers=32,
+        readonly=True,
+        lock=False,
+        readahead=False,
+        meminit=False,
+    )
+
+
+class LMDBStore():
+    """
+    Read-only view over an LMDB dataset written by prepare_data.py. The JPEG bytes of every
+    resolution live under "{size}-{index}" keys, with the label and the original path of the
+    image under "label-{index}" and "path-{index}". The environment is only opened on the first
+    read of each process, so that every DataLoader worker gets its own handle after the fork.
+    """
+
+    def __init__(self, path, resolution) -> None:
+        self.path = path
+        self.resolution = resolution
+
+        env = open_env(path)
+        if not env:
+            raise IOError('Cannot open lmdb dataset', path)
+
+        with env.begin(write=False) as txn:
+            self.length = int(txn.get("length".encode("utf-8")).decode("utf-8"))
+
+            if txn.get(get_image_key(resolution, 0)) is None:
+                raise ValueError(f"{path} has no images of resolution {resolution}")
+
+            paths = [txn.get(get_path_key(i)) for i in range(self.length)]
+            labels = [txn.get(get_label_key(i)) for i in range(self.length)]
+
+        env.close()
+
+        # datasets written before the labels and paths were stored only have the images
+        self.paths = [path.decode("utf-8") for path in paths] if None not in paths else []
+        self.labels = np.array([int(label) for label in labels] if None not in labels else [-1] * self.length, dtype=np.int64)
+
+        self.path_index = {path: i for i, path in enumerate(self.paths)}
+        self.env = None
+        self.pid = None
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, path):
+        return path in self.path_index
+
+    def covers(self, dir, cache_dir=DEFAULT_CACHE_DIR):
+        return covers_dir(self.paths, dir, cache_dir)
+
+    def get_env(self):
+        if self.env is None or self.pid != os.getpid():
+            # a handle inherited through fork can't be used, and lmdb refuses to open the same
+            # environment twice in a process, so the inherited one is released first
+            if self.env is not None:
+                self.env.close()
+
+            self.env = open_env(self.path)
+            self.pid = os.getpid()
+
+        return self.env
+
+    def get(self, index):
+        with self.get_env().begin(write=False) as txn:
+            img_bytes = txn.get(get_image_key(self.resolution, index))
+
+        return Image.open(BytesIO(img_bytes)).convert("RGB")
+
+    def load(self, path):
+        return self.get(self.path_index[path])
+
+    def __getstate__(self):
+        # environment handles can't be pickled, spawned workers open their own
+        state = self.__dict__.copy()
+        state["env"], state["pid"] = None, None
+        return state
+
+
+class LMDBDataset(torch.utils.data.Dataset):
+    """Map-style (image, label) dataset over an LMDB store, in place of an ImageFolder."""
+
+    def __init__(self, store: LMDBStore, transform=None) -> None:
+        self.store = store
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, index):
+        img = self.store.get(index)
+        if self.transform is not None:
+            img = self.transform(img)
+
+        return img, int(self.store.labels[index])
+
+
+def get_lmdb_store(args):
+    """Returns the LMDB dataset set by lmdb_path in the config, or None if unset."""
+    if not args.lmdb_path:
+        return None
+
+    key = f"{args.lmdb_path}@{args.lmdb_resolution}"
+    if key not in _stores:
+        _stores[key] = LMDBStore(args.lmdb_path, args.lmdb_resolution)
+        logging.info(f"Using the lmdb dataset at {args.lmdb_path} ({args.lmdb_resolution}px)")
+
+    return _stores[key]
@@ -0,0 +1,179 @@
+import glob
+import hashlib
+import os
+import re
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+
+import utils.logger as logging
+
+DEFAULT_CACHE_DIR = "save/misc"
+
+# manifests already loaded by this process, keyed by their glob pattern
+_manifests: Dict[str, "DatasetManifest"] = {}
+
+
+class DatasetManifest():
+    """
+    Index of every image matched by a glob pattern, with its label index (from the name of the
+    parent folder), file size and image dimensions. It is persisted once in a compact .npz file
+    and invalidated as soon as the mtime of one of the scanned directories changes.
+    """
+
+    def __init__(self, pattern, paths, labels, class_names, file_sizes, widths, heights, dirs, dir_mtimes) -> None:
+        self.pattern = pattern
+        self.paths: List[str] = paths
+        self.labels = labels
+        self.class_names: List[str] = class_names
+        self.file_sizes = file_sizes
+        self.widths = widths
+        self.heights = heights
+        self.dirs: List[str] = dirs
+        self.dir_mtimes = dir_mtimes
+
+    def __len__(self):
+        return len(self.paths)
+
+    def is_stale(self):
+        dirs, mtimes = scan_dirs(self.pattern)
+        return dirs != self.dirs or not np.array_equal(mtimes, self.dir_mtimes)
+
+    def save(self, out):
+        tmp = out + ".tmp.npz"
+        np.savez(
+            tmp,
+            pattern=np.array(self.pattern),
+            paths=encode_strings(self.paths),
+            labels=self.labels,
+            class_names=encode_strings(self.class_names),
+            file_sizes=self.file_sizes,
+            widths=self.widths,
+            heights=self.heights,
+            dirs=encode_strings(self.dirs),
+            dir_mtimes=self.dir_mtimes,
+        )
+        os.replace(tmp, out)
+
+    @classmethod
+    def load(cls, out):
+        with np.load(out) as data:
+            return cls(
+                str(data["pattern"]),
+                decode_strings(data["paths"]),
+                data["labels"],
+                decode_strings(data["class_names"]),
+                data["file_sizes"],
+                data["widths"],
+                data["heights"],
+                decode_strings(data["dirs"]),
+                data["dir_mtimes"],
+            )
+
+    @classmethod
+    def build(cls, pattern):
+        dirs, dir_mtimes = scan_dirs(pattern)
+        paths = sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+
+        class_names = sorted({path.split('/')[-2] for path in paths})
+        class_index = {label: index for index, label in enumerate(class_names)}
+
+        labels = np.empty(len(paths), dtype=np.int32)
+        file_sizes = np.empty(len(paths), dtype=np.int64)
+        widths = np.full(len(paths), -1, dtype=np.int32)
+        heights = np.full(len(paths), -1, dtype=np.int32)
+
+        for i, path in enumerate(paths):
+            labels[i] = class_index[path.split('/')[-2]]
+            file_sizes[i] = os.path.getsize(path)
+
+            try:
+                # only the header is read here, the pixels are not decoded
+                with Image.open(path) as img:
+                    widths[i], heights[i] = img.size
+
+            except (IOError, SyntaxError):
+                pass
+
+        return cls(pattern, paths, labels, class_names, file_sizes, widths, heights, dirs, dir_mtimes)
+
+
+def scan_dirs(pattern):
+    """Returns every directory that has to be listed to expand the pattern, with its mtime."""
+    parts = pattern.split('/')
+
+    # the directories above the first wildcard never need to be listed except the deepest one
+    root = next((depth for depth, part in enumerate(parts) if glob.has_magic(part)), len(parts) - 1)
+
+    dirs = []
+    for depth in range(max(root, 1), len(parts)):
+        prefix = '/'.join(parts[:depth])
+        dirs.extend(sorted(path for path in glob.glob(prefix) if os.path.isdir(path)))
+
+    mtimes = np.array([os.stat(dir).st_mtime_ns for dir in dirs], dtype=np.int64)
+    return dirs, mtimes
+
+
+def encode_strings(strings):
+    return np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def decode_strings(data):
+    text = data.tobytes().decode("utf-8")
+    return text.split("\n") if text else []
+
+
+def get_manifest_file(pattern, cache_dir):
+    name = re.sub(r'[^A-Za-z0-9]+', '_', pattern).strip('_')[-60:]
+    digest = hashlib.sha1(pattern.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(cache_dir, "manifests", f"{name}_{digest}.npz")
+
+
+def get_manifest(pattern, cache_dir=DEFAULT_CACHE_DIR) -> DatasetManifest:
+    """
+    Returns the manifest of the images matched by pattern. The directories are only scanned
+    again when the on-disk index is missing or one of them has been modified.
+    """
+    manifest = _manifests.get(pattern)
+    if manifest is not None and not manifest.is_stale():
+        return manifest
+
+    out = get_manifest_file(pattern, cache_dir)
+    manifest = None
+    try:
+        manifest = DatasetManifest.load(out)
+        if manifest.is_stale():
+            logging.info(f"Manifest {out} is out of date, rescanning {pattern}")
+            manifest = None
+
+    except (IOError, ValueError, KeyError):
+        pass
+
+    if manifest is None:
+        manifest = DatasetManifest.build(pattern)
+
+        try:
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            manifest.save(out)
+            logging.info(f"Manifest of {len(manifest)} images saved at {out}")
+
+        except IOError as er:
+            logging.error(er)
+
+    _manifests[pattern] = manifest
+    return manifest
+
+
+def get_image_paths(pattern, cache_dir=DEFAULT_CACHE_DIR) -> List[str]:
+    """Drop-in replacement for glob.glob(pattern) that reads the paths from the manifest."""
+    return list(get_manifest(pattern, cache_dir).paths)
+
+
+def covers_dir(paths, dir, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Whether paths are exactly the images of dir in the dir/<class>/<image> layout ImageFolder
+    reads. A store compiled from a subset or another layout of dir is not a replacement for it.
+    """
+    images = get_manifest(dir + '/*/*', cache_dir).paths
+    return len(images) > 0 and len(paths) == len(images) and set(paths) == set(images)
@@ -1,4 +1,8 @@
+import os
 from dataclasses import dataclass, field
+from typing import List
+
+import numpy as np
 
 
 @dataclass(order=True)
@@ -9,4 +13,159 @@ class PathLoss:
     loss: int
 
     def __post_init__(self):
-        self.sort_index = self.loss
\ No newline at end of file
+        self.sort_index = self.loss
+
+
+def get_sample_path(sample: PathLoss):
+    return sample.path[0] if isinstance(sample.path, (tuple, list)) else sample.path
+
+
+class StringPool():
+    """Append-only utf-8 strings kept in one byte buffer with their offsets, string i is data[offsets[i]:offsets[i+1]]."""
+
+    def __init__(self, data=None, offsets=None) -> None:
+        self.data = np.empty(0, dtype=np.uint8) if data is None else data
+        self.offsets = np.zeros(1, dtype=np.int64) if offsets is None else offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.data[self.offsets[idx]: self.offsets[idx + 1]].tobytes().decode("utf-8")
+
+    def extend(self, strings: List[str]):
+        """Appends the strings and returns the id of the first one."""
+        start = len(self)
+        encoded = [string.encode("utf-8") for string in strings]
+
+        lengths = np.fromiter((len(string) for string in encoded), dtype=np.int64, count=len(encoded))
+        self.data = np.concatenate((self.data, np.frombuffer(b"".join(encoded), dtype=np.uint8)))
+        self.offsets = np.concatenate((self.offsets, self.offsets[-1] + np.cumsum(lengths)))
+
+        return start
+
+    def extend_pool(self, other):
+        start = len(self)
+        self.offsets = np.concatenate((self.offsets, self.offsets[-1] + other.offsets[1:]))
+        self.data = np.concatenate((self.data, other.data))
+
+        return start
+
+
+class PathLossTable():
+    """
+    Columnar replacement of a List[PathLoss]: the paths are interned in a StringPool and the
+    rows only hold an int32 path id, a float32 loss and an int32 label (-1 if unknown). Rows
+    are sorted, sliced and concatenated with numpy, and a table forked into DataLoader workers
+    is a handful of arrays instead of one Python object per candidate. Indexing a row still
+    returns a PathLoss, so the code written for lists keeps working.
+    """
+
+    def __init__(self, pool: StringPool, path_ids, losses, labels) -> None:
+        self.pool = pool
+        self.path_ids = np.asarray(path_ids, dtype=np.int32)
+        self.losses = np.asarray(losses, dtype=np.float32)
+        self.labels = np.asarray(labels, dtype=np.int32)
+
+    @staticmethod
+    def from_paths(paths: List[str], losses=None, labels=None):
+        pool = StringPool()
+        unique = list(dict.fromkeys(paths))
+        ids = {path: i for i, path in enumerate(unique)}
+        pool.extend(unique)
+
+        n = len(paths)
+        return PathLossTable(
+            pool, np.fromiter((ids[path] for path in paths), dtype=np.int32, count=n),
+            np.zeros(n) if losses is None else losses,
+            np.full(n, -1) if labels is None else labels)
+
+    @staticmethod
+    def from_samples(samples):
+        if isinstance(samples, PathLossTable):
+            return samples
+
+        return PathLossTable.from_paths([get_sample_path(sample) for sample in samples], [sample.loss for sample in samples])
+
+    def __len__(self):
+        return len(self.path_ids)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return PathLoss(self.pool[self.path_ids[idx]], float(self.losses[idx]))
+
+        return PathLossTable(self.pool, self.path_ids[idx], self.losses[idx], self.labels[idx])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def path(self, idx):
+        return self.pool[self.path_ids[idx]]
+
+    def paths(self) -> List[str]:
+        return [self.pool[i] for i in self.path_ids]
+
+    def copy(self):
+        return PathLossTable(self.pool, self.path_ids.copy(), self.losses.copy(), self.labels.copy())
+
+    def sort(self, reverse=False):
+        """The rows ordered by loss. Ties keep their order, like sorted(..., key=lambda x: x.loss)."""
+        order = np.argsort(-self.losses if reverse else self.losses, kind="stable")
+        return self[order]
+
+    def extend(self, samples):
+        """Appends the rows of a table or a list of PathLoss in place."""
+        other = PathLossTable.from_samples(samples)
+        path_ids = other.path_ids
+        if other.pool is not self.pool:
+            # the pool is append-only, so the tables sharing it stay valid. Only the paths the
+            # rows reference are interned, a few rows taken from a large table keep it small
+            used, path_ids = np.unique(other.path_ids, return_inverse=True)
+            if len(used) == len(other.pool):
+                path_ids = used[path_ids] + self.pool.extend_pool(other.pool)
+            else:
+                path_ids = path_ids + self.pool.extend([other.pool[i] for i in used])
+
+        self.path_ids = np.concatenate((self.path_ids, path_ids.astype(np.int32)))
+        self.losses = np.concatenate((self.losses, other.losses))
+        self.labels = np.concatenate((self.labels, other.labels))
+
+    @staticmethod
+    def concat(tables):
+        table = tables[0].copy()
+        for other in tables[1:]:
+            table.extend(other)
+
+        return table
+
+    def save(self, dir):
+        """Writes the columns as .npy files that load can memory map."""
+        os.makedirs(dir, exist_ok=True)
+
+        # only the paths referenced by the rows are written
+        used, path_ids = np.unique(self.path_ids, return_inverse=True)
+        pool = StringPool()
+        pool.extend([self.pool[i] for i in used])
+
+        for name, column in [("data", pool.data), ("offsets", pool.offsets), ("path_ids", path_ids.astype(np.int32)),
+                             ("losses", self.losses), ("labels", self.labels)]:
+            np.save(os.path.join(dir, f"{name}.npy"), column)
+
+    @staticmethod
+    def load(dir, mmap=True):
+        columns = {
+            name: np.load(os.path.join(dir, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in ["data", "offsets", "path_ids", "losses", "labels"]
+        }
+
+        pool = StringPool(columns["data"], columns["offsets"])
+        return PathLossTable(pool, columns["path_ids"], columns["losses"], columns["labels"])
+
+
+def take_samples(samples, indices):
+    """The rows of a PathLossTable or a List[PathLoss] at indices, in that order."""
+    if isinstance(samples, PathLossTable):
+        return samples[np.asarray(indices, dtype=np.int64)]
+
+    return [samples[i] for i in indices]
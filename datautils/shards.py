@@ -0,0 +1,206 @@
+import argparse
+import io
+import math
+import os
+import random
+import tarfile
+from typing import Dict
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from datautils.manifest import DEFAULT_CACHE_DIR, covers_dir, decode_strings, encode_strings, get_manifest
+from utils.commons import decode_image
+import utils.logger as logging
+
+INDEX_FILE = "index.npz"
+
+# shard sets already opened by this process, keyed by their directory
+_shard_sets: Dict[str, "ShardSet"] = {}
+
+
+def get_shard_name(shard):
+    return f"shard-{str(shard).zfill(5)}.tar"
+
+
+class ShardSet():
+    """
+    Dataset written as fixed-size tar shards, each one holding the encoded bytes of its
+    images as "{index}{ext}" members. The index keeps the path and the label of every image
+    and the shard it was written to, so a subset of the images can be streamed by path.
+    """
+
+    def __init__(self, dir) -> None:
+        self.dir = dir
+
+        with np.load(os.path.join(dir, INDEX_FILE)) as index:
+            self.paths = decode_strings(index["paths"])
+            self.labels = index["labels"]
+            self.shards = index["shards"]
+
+        self.num_shards = int(self.shards.max()) + 1 if len(self.shards) > 0 else 0
+        self.path_index = {path: i for i, path in enumerate(self.paths)}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self.path_index
+
+    def covers(self, dir, cache_dir=DEFAULT_CACHE_DIR):
+        return covers_dir(self.paths, dir, cache_dir)
+
+    def covers_paths(self, paths):
+        return len(paths) > 0 and all(path in self.path_index for path in paths)
+
+    def get_shard_file(self, shard):
+        return os.path.join(self.dir, get_shard_name(shard))
+
+
+class ShardDataset(torch.utils.data.IterableDataset):
+    """
+    Streams the images of a shard set with large sequential reads. The order of the shards
+    is shuffled every epoch, the shards are split across the DataLoader workers and a
+    shuffle buffer mixes the images of the shards a worker reads. When paths is given, only
+    those images are returned, which is how the subsets picked by active learning are read.
+    """
+
+    def __init__(self, shard_set: ShardSet, transform, shuffle_buffer=1000, with_label=True, paths=None, draft_size=None) -> None:
+        self.shard_set = shard_set
+        self.transform = transform
+        self.shuffle_buffer = shuffle_buffer
+        self.with_label = with_label
+        self.draft_size = draft_size
+        self.epoch = 0
+
+        self.indices = None
+        shards = range(shard_set.num_shards)
+        if paths is not None:
+            self.indices = {shard_set.path_index[path] for path in paths}
+            shards = sorted({int(shard_set.shards[i]) for i in self.indices})
+
+        self.shard_ids = list(shards)
+
+    def __len__(self):
+        # every worker ends its share with a partial batch, so the loaders drop them: with
+        # drop_last, len(loader) is then an upper bound of the batches of an epoch
+        return len(self.shard_set) if self.indices is None else len(self.indices)
+
+    def get_worker_shards(self):
+        worker_info = torch.utils.data.get_worker_info()
+
+        # every worker draws the same order from the seed of the epoch, then takes its own share
+        if worker_info is None:
+            seed, worker_id, num_workers = torch.initial_seed() + self.epoch, 0, 1
+            self.epoch += 1
+        else:
+            seed, worker_id, num_workers = worker_info.seed - worker_info.id, worker_info.id, worker_info.num_workers
+
+        shards = list(self.shard_ids)
+        random.Random(seed).shuffle(shards)
+
+        return shards[worker_id::num_workers], random.Random(seed + worker_id + 1)
+
+    def read_shard(self, shard):
+        with tarfile.open(self.shard_set.get_shard_file(shard), "r|") as tar:
+            for member in tar:
+                index = int(os.path.splitext(member.name)[0])
+                if self.indices is not None and index not in self.indices:
+                    continue
+
+                yield index, tar.extractfile(member).read()
+
+    def get_item(self, index, data):
+        img = self.transform(decode_image(io.BytesIO(data), self.draft_size))
+        if not self.with_label:
+            return img
+
+        return img, int(self.shard_set.labels[index])
+
+    def __iter__(self):
+        shards, rng = self.get_worker_shards()
+
+        buffer = []
+        for shard in shards:
+            for sample in self.read_shard(shard):
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(sample)
+                    continue
+
+                i = rng.randrange(len(buffer))
+                buffer[i], sample = sample, buffer[i]
+                yield self.get_item(*sample)
+
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield self.get_item(*sample)
+
+
+def get_shard_set(args):
+    """Returns the shard set written to shard_dir in the config, or None if unset."""
+    if not args.shard_dir:
+        return None
+
+    if args.shard_dir not in _shard_sets:
+        _shard_sets[args.shard_dir] = ShardSet(args.shard_dir)
+        logging.info(f"Streaming the pretraining images from the shards at {args.shard_dir}")
+
+    return _shard_sets[args.shard_dir]
+
+
+def get_shard_dataset(args, transform, with_label=True, dir=None, paths=None, draft_size=None):
+    """
+    Returns a ShardDataset over the images of dir (or over paths) if the configured shard
+    set holds all of them, else None so that the caller falls back to its map-style dataset.
+    """
+    shard_set = get_shard_set(args)
+    if shard_set is None:
+        return None
+
+    if (dir is not None and not shard_set.covers(dir, args.model_misc_path)) or (paths is not None and not shard_set.covers_paths(paths)):
+        return None
+
+    return ShardDataset(shard_set, transform, args.shard_shuffle_buffer, with_label=with_label, paths=paths, draft_size=draft_size)
+
+
+def write_shards(pattern, out, shard_size=1000, cache_dir="save/misc", seed=0):
+    """
+    Copies the encoded bytes of every image matched by pattern into tar shards of shard_size
+    images. The images are shuffled once before they are written, so that each shard mixes
+    the classes and the shuffle buffer only has to mix images of a few shards.
+    """
+    manifest = get_manifest(pattern, cache_dir)
+    os.makedirs(out, exist_ok=True)
+
+    # the manifest records no size for the images whose header could not be read
+    order = [i for i in range(len(manifest)) if manifest.widths[i] > 0]
+    random.Random(seed).shuffle(order)
+
+    shards = np.arange(len(order), dtype=np.int32) // shard_size
+    for shard in tqdm(range(math.ceil(len(order) / shard_size))):
+        with tarfile.open(os.path.join(out, get_shard_name(shard)), "w") as tar:
+            for index in range(shard * shard_size, min((shard + 1) * shard_size, len(order))):
+                path = manifest.paths[order[index]]
+                tar.add(path, arcname=f"{index}{os.path.splitext(path)[1]}")
+
+    np.savez(
+        os.path.join(out, INDEX_FILE),
+        paths=encode_strings([manifest.paths[i] for i in order]),
+        labels=manifest.labels[order],
+        shards=shards,
+    )
+
+    logging.info(f"{len(order)} images written into {len(set(shards.tolist()))} shards at {out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a dataset as tar shards for streaming pretraining")
+    parser.add_argument("--out", type=str, help="directory of the shards")
+    parser.add_argument("--shard_size", type=int, default=1000, help="number of images per shard")
+    parser.add_argument("--cache_dir", type=str, default="save/misc", help="directory of the dataset manifests")
+    parser.add_argument("pattern", type=str, help="glob pattern of the images, e.g. './datasets/ham10000/*/*'")
+
+    args = parser.parse_args()
+
+    write_shards(args.pattern, args.out, args.shard_size, args.cache_dir)
@@ -4,19 +4,25 @@ import torchvision
 from torchvision.transforms import ToTensor, Compose
 import random
 
-from datautils.path_loss import PathLoss
+from datautils.image_store import get_image_source, get_source_dataset
+from datautils.manifest import get_image_paths
+from datautils.path_loss import PathLossTable
+from datautils.shards import get_shard_dataset
 
 from models.active_learning.pretext_dataloader import MakeBatchDataset, PretextMultiCropDataset
+from models.active_learning.rotation import RotationLoader
 from models.self_sup.simclr.transformation import TransformsSimCLR
 from models.self_sup.simclr.transformation.dcl_transformations import TransformsDCL
+from models.self_sup.swav.transformation.multicropdataset import MultiCropTransform
 from models.self_sup.swav.transformation.swav_transformation import TransformsSwAV
-from models.utils.commons import get_images_pathlist, get_params, split_dataset2
+from models.utils.commons import get_images_pathlist, get_params, split_dataset2, split_paths_by_hash
 from models.utils.training_type_enum import TrainingType
 from models.utils.ssl_method_enum import SSL_Method
 
 from datautils import dataset_enum
 from models.utils.transformations import Transforms
 
+from utils.commons import get_draft_size
 import utils.logger as logging
 
 class TargetDataset():
@@ -34,6 +40,15 @@ class TargetDataset():
 
     
     def get_dataset(self, transforms, is_tsne=False):
+        if self.training_type != TrainingType.ACTIVE_LEARNING:
+            dataset = get_shard_dataset(self.args, transforms, dir=self.dir, draft_size=get_draft_size(self.args, self.image_size))
+            if dataset is not None:
+                return dataset
+
+        image_source = get_image_source(self.args)
+        if self.training_type != TrainingType.ACTIVE_LEARNING and image_source is not None and image_source.covers(self.dir, self.args.model_misc_path):
+            return get_source_dataset(image_source, transform=transforms)
+
         return MakeBatchDataset(
             self.args, self.dir, self.with_train, 
             self.is_train, is_tsne, transforms) if self.training_type == TrainingType.ACTIVE_LEARNING else torchvision.datasets.ImageFolder(
@@ -47,25 +62,66 @@ class TargetDataset():
 
         train_ds, val_ds = split_dataset2(dataset=dataset, ratio=0.7, is_classifier=True)
 
-        train_loader = torch.utils.data.DataLoader(
+        train_loader = RotationLoader(torch.utils.data.DataLoader(
                     train_ds, 
                     batch_size=train_batch_size,
                     num_workers=self.args.workers,
                     shuffle=True,
                     pin_memory=True
-                )
-        val_loader = torch.utils.data.DataLoader(
+                ))
+        val_loader = RotationLoader(torch.utils.data.DataLoader(
                         val_ds, 
                         batch_size=val_batch_size, 
                         num_workers=self.args.workers,
                         shuffle=False,
                         pin_memory=True
-                    )
+                    ))
 
         print(f"The size of the dataset is ({len(train_ds)}, {len(val_ds)}) and the number of batches is ({train_loader.__len__()}, {val_loader.__len__()}) for a batch size of {self.batch_size}")
 
         return train_loader, val_loader
 
+    def get_incremental_finetuner_loaders(self, train_batch_size, val_batch_size, path_list, new_paths):
+        """
+        Finetuner loaders over a stable hash split of path_list. An epoch draws
+        al_incremental_epoch_multiple times as many samples as there are new training paths, and
+        the new paths are drawn al_incremental_new_weight times as often as the ones seen before.
+        """
+        transforms = Transforms(self.image_size)
+        train_paths, val_paths = split_paths_by_hash(path_list, ratio=0.7)
+
+        new_paths = set(new_paths)
+        is_new = [path in new_paths for path in train_paths]
+        weights = torch.tensor([self.args.al_incremental_new_weight if new else 1.0 for new in is_new])
+        num_new = sum(is_new) or len(train_paths)
+        num_samples = min(len(train_paths), num_new * self.args.al_incremental_epoch_multiple)
+
+        train_ds = MakeBatchDataset(
+            self.args, self.dir, self.with_train, self.is_train,
+            is_tsne=False, transform=transforms, path_list=train_paths)
+        val_ds = MakeBatchDataset(
+            self.args, self.dir, self.with_train, self.is_train,
+            is_tsne=False, transform=transforms, path_list=val_paths)
+
+        train_loader = RotationLoader(torch.utils.data.DataLoader(
+                    train_ds,
+                    batch_size=train_batch_size,
+                    num_workers=self.args.workers,
+                    sampler=torch.utils.data.WeightedRandomSampler(weights, num_samples, replacement=True),
+                    pin_memory=True
+                ))
+        val_loader = RotationLoader(torch.utils.data.DataLoader(
+                        val_ds,
+                        batch_size=val_batch_size,
+                        num_workers=self.args.workers,
+                        shuffle=False,
+                        pin_memory=True
+                    ))
+
+        logging.info(f"Incremental finetuning on ({len(train_ds)}, {len(val_ds)}) images, {num_samples} draws per epoch for {len(new_paths)} new images")
+
+        return train_loader, val_loader
+
     def get_loader(self):
         if self.method is not SSL_Method.SWAV.value or self.training_type in [TrainingType.ACTIVE_LEARNING, TrainingType.BASE_PRETRAIN]:
             if self.training_type == TrainingType.ACTIVE_LEARNING:
@@ -73,7 +129,7 @@ class TargetDataset():
                 dataset = self.get_dataset(transforms)
 
             elif self.training_type == TrainingType.BASE_PRETRAIN:
-                img_path = glob.glob(self.dir + '/*')
+                img_path = get_image_paths(self.dir + '/*', self.args.model_misc_path)
                 logging.info(f"Original size of generated images dataset is {len(img_path)}")
 
                 # real_target = get_images_pathlist(f'{self.args.dataset_dir}/{dataset_enum.get_dataset_enum(self.args.target_dataset)}', with_train=True)
@@ -91,13 +147,22 @@ class TargetDataset():
                 # logging.info(f"Augmenting {augment_size} proxy source images to the generated dataset")
                 # img_path.extend(source_proxy[0:augment_size])
 
-                path_loss_list = [PathLoss(path, 0) for path in img_path]
-                
-                dataset = PretextMultiCropDataset(
+                dataset = get_shard_dataset(
                     self.args,
-                    path_loss_list,
+                    MultiCropTransform(self.args.size_crops, self.args.nmb_crops, self.args.min_scale_crops, self.args.max_scale_crops),
+                    with_label=False,
+                    paths=img_path,
+                    draft_size=get_draft_size(self.args, max(self.args.size_crops)),
                 )
 
+                if dataset is None:
+                    path_loss_list = PathLossTable.from_paths(img_path)
+                    
+                    dataset = PretextMultiCropDataset(
+                        self.args,
+                        path_loss_list,
+                    )
+
             else:
                 if self.method == SSL_Method.SIMCLR.value:
                     transforms = TransformsSimCLR(self.image_size)
@@ -120,9 +185,13 @@ class TargetDataset():
                 dataset,
                 batch_size=self.batch_size,
                 pin_memory=True,
-                shuffle=self.is_train, 
-                num_workers=self.args.workers
+                shuffle=self.is_train and not isinstance(dataset, torch.utils.data.IterableDataset), 
+                num_workers=self.args.workers,
+                drop_last=isinstance(dataset, torch.utils.data.IterableDataset),
             )
+
+            if self.training_type == TrainingType.ACTIVE_LEARNING:
+                loader = RotationLoader(loader)
         
         else:
             swav = TransformsSwAV(self.args, self.batch_size, self.dir)
@@ -41,7 +41,10 @@ def run_sequence(args, writer):
         pretrainer.second_pretrain()
 
     classifier = Classifier(args, pretrain_level="2" if args.target_pretrain else "1")
-    classifier.train_and_eval()
+    if args.lc_sweep:
+        classifier.sweep()
+    else:
+        classifier.train_and_eval()
 
 def pretrain_budget(args, writer):
     al_trainer_sample_size = [800, 400] #[1200, 600] #[1620, 3240, 5000]
@@ -0,0 +1,187 @@
+import os
+import random
+from typing import Callable, Dict, List
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from datautils.manifest import decode_strings, encode_strings
+import utils.logger as logging
+
+# acquisition name -> function mapping a chunk of [n, C] logits to its [n] scores, the higher
+# the more informative
+ACQUISITIONS: Dict[str, Callable] = {}
+
+# rows of the logits scored at a time
+CHUNK_SIZE = 65536
+
+
+def register_acquisition(name):
+    def register(fn):
+        ACQUISITIONS[name] = fn
+        return fn
+
+    return register
+
+
+@register_acquisition("least_confidence")
+def least_confidence(logits):
+    # the lower the top1 probability, the more uncertain the sample
+    return -F.softmax(logits, dim=1).max(dim=1)[0]
+
+
+@register_acquisition("entropy")
+def entropy(logits):
+    log_probs = F.log_softmax(logits, dim=1)
+    return -(log_probs.exp() * log_probs).sum(dim=1)
+
+
+@register_acquisition("margin")
+def margin(logits):
+    top2 = F.softmax(logits, dim=1).topk(2, dim=1)[0]
+    return top2[:, 1] - top2[:, 0]
+
+
+@register_acquisition("random")
+def random_scores(logits):
+    return torch.rand(logits.size(0), device=logits.device)
+
+
+# the rank of a sample depends on the whole pool, so the fused scores are computed over the
+# [N] scores of every chunk instead of chunk by chunk
+RANK_FUSION = ["least_confidence", "entropy", "margin"]
+
+
+def rank_fusion(scores):
+    # mean rank of the sample under the uncertainty scores, rank 0 being the most uncertain
+    ranks = [torch.argsort(torch.argsort(sample_scores, descending=True)) for sample_scores in scores]
+    return -torch.stack(ranks).float().mean(dim=0)
+
+
+def iter_chunks(logits, chunk_size):
+    """Float tensors of chunk_size rows of the logits, a tensor or a (memory-mapped) array."""
+    for start in range(0, len(logits), chunk_size):
+        chunk = logits[start: start + chunk_size]
+        if isinstance(chunk, np.ndarray):
+            chunk = torch.from_numpy(np.array(chunk))
+
+        yield chunk.float()
+
+
+def get_scores(name, logits, chunk_size=CHUNK_SIZE):
+    """[N] scores of the acquisition, the logits being read chunk_size rows at a time."""
+    if name == "rank_fusion":
+        return rank_fusion([get_scores(fused, logits, chunk_size) for fused in RANK_FUSION])
+
+    if name not in ACQUISITIONS:
+        raise ValueError(f"'{name}' acquisition doesn't exist")
+
+    return torch.cat([ACQUISITIONS[name](chunk) for chunk in iter_chunks(logits, chunk_size)])
+
+
+def running_topk(name, logits, top_k, chunk_size=CHUNK_SIZE):
+    # only the best top_k scores seen so far are kept, torch.topk returns them from the most
+    # to the least informative
+    best_scores, best_indices, count = None, None, 0
+    for chunk in iter_chunks(logits, chunk_size):
+        scores = ACQUISITIONS[name](chunk)
+        indices = torch.arange(count, count + scores.size(0))
+        count += scores.size(0)
+
+        if best_scores is not None:
+            scores = torch.cat((best_scores, scores))
+            indices = torch.cat((best_indices, indices))
+
+        best_scores, top = torch.topk(scores, min(top_k, scores.size(0)))
+        best_indices = indices[top]
+
+    return [] if best_indices is None else best_indices.tolist()
+
+
+def select_both(logits, top_k=None):
+    # the original "both" selection: the least confidence and entropy orderings are concatenated,
+    # shuffled and halved, so a sample can be picked twice
+    indices1 = torch.argsort(get_scores("least_confidence", logits), descending=True)
+    indices2 = torch.argsort(get_scores("entropy", logits), descending=True)
+
+    indices = torch.cat((indices1, indices2)).tolist()
+    random.shuffle(indices)
+    indices = indices[: (len(indices)//2)]
+
+    return indices if top_k is None else indices[:top_k]
+
+
+def select_samples(name, logits, top_k=None) -> List[int]:
+    """
+    Indices of the top_k most informative samples under the acquisition, from the most to the
+    least. The [N, C] logits can be a memory-mapped array, they are read a chunk at a time.
+    """
+    if name == "both":
+        return select_both(logits, top_k)
+
+    if top_k is not None and name in ACQUISITIONS:
+        return running_topk(name, logits, top_k)
+
+    scores = get_scores(name, logits)
+    if top_k is None:
+        return torch.argsort(scores, descending=True).tolist()
+
+    return torch.topk(scores, min(top_k, scores.size(0)))[1].tolist()
+
+
+def select_all(logits, top_k=None) -> Dict[str, List[int]]:
+    """The selection of every registered acquisition on the same (memory-mapped) logits, without another forward pass."""
+    return {name: select_samples(name, logits, top_k) for name in list(ACQUISITIONS) + ["rank_fusion", "both"]}
+
+
+def get_logits_file(args, name):
+    return os.path.join(args.model_misc_path, "logits", f"{name}.npy")
+
+
+def get_paths_file(args, name):
+    return os.path.join(args.model_misc_path, "logits", f"{name}_paths.npy")
+
+
+class LogitWriter():
+    """
+    Writes the logits of a scoring pass batch by batch into a memory-mapped [N, C] .npy file
+    under model_misc_path/logits, with the paths of its rows next to it. The selection of any
+    acquisition can be derived from the file afterwards, without another forward pass.
+    """
+
+    def __init__(self, args, paths, name) -> None:
+        self.file = get_logits_file(args, name)
+        self.paths_file = get_paths_file(args, name)
+        self.paths = paths
+        self.logits = None
+        self.count = 0
+
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+
+    def append(self, logits):
+        if self.logits is None:
+            self.logits = np.lib.format.open_memmap(self.file, mode="w+", dtype=np.float32, shape=(len(self.paths), logits.size(1)))
+
+        self.logits[self.count: self.count + logits.size(0)] = logits.detach().float().cpu().numpy()
+        self.count += logits.size(0)
+
+    def close(self):
+        """Returns the memory-mapped logits once every row is written."""
+        if self.logits is None:
+            return np.empty((0, 0), dtype=np.float32)
+
+        self.logits.flush()
+        np.save(self.paths_file, encode_strings(self.paths))
+
+        return self.logits
+
+
+def load_logits(args, name):
+    """Returns the memory-mapped logits and the paths saved by the sampler under name, or None if missing."""
+    try:
+        return np.load(get_logits_file(args, name), mmap_mode="r"), decode_strings(np.load(get_paths_file(args, name)))
+
+    except IOError as er:
+        logging.error(er)
+        return None
@@ -4,6 +4,10 @@ class AL_Method(Enum):
     LEAST_CONFIDENCE = 0
     ENTROPY = 1
     BOTH = 2
+    CORESET = 3
+    MARGIN = 4
+    RANK_FUSION = 5
+    RANDOM = 6
 
 def get_al_method_enum(value: int):
     if value == AL_Method.LEAST_CONFIDENCE.value:
@@ -13,4 +17,16 @@ def get_al_method_enum(value: int):
         return "entropy"
 
     if value == AL_Method.BOTH.value:
-        return "both"
\ No newline at end of file
+        return "both"
+
+    if value == AL_Method.CORESET.value:
+        return "coreset"
+
+    if value == AL_Method.MARGIN.value:
+        return "margin"
+
+    if value == AL_Method.RANK_FUSION.value:
+        return "rank_fusion"
+
+    if value == AL_Method.RANDOM.value:
+        return "random"
\ No newline at end of file
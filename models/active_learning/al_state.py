@@ -0,0 +1,91 @@
+import os
+from typing import Dict, List
+
+import torch
+
+from datautils.path_loss import PathLossTable
+from utils.random_seeders import get_rng_states, set_rng_states
+import utils.logger as logging
+
+# stages of an AL batch, in the order they complete
+SAMPLED = "sampled"
+PRETRAINED = "pretrained"
+FINETUNED = "finetuned"
+STAGES = [SAMPLED, PRETRAINED, FINETUNED]
+
+
+class ALCycleState():
+    """
+    Everything active_learning_new needs to continue after a crash: the sample pool, the
+    paths selected at each batch, the encoder weights, the best finetuner accuracy and
+    weights, the random generator states and the last completed (batch, stage). It is saved
+    after every stage.
+    """
+
+    def __init__(self) -> None:
+        self.batch = -1
+        self.stage = None
+        self.pool: PathLossTable = None
+        self.selected: Dict[int, List[str]] = {}
+        self.encoder = None
+        self.best_trainer_acc = 0
+        self.best_model = None
+        self.rng_states = None
+
+    def is_done(self, batch, stage):
+        if self.stage is None:
+            return False
+
+        return (batch, STAGES.index(stage)) <= (self.batch, STAGES.index(self.stage))
+
+    def restore(self, encoder) -> PathLossTable:
+        """Loads the saved weights into the encoder and the generator states, returns the pool."""
+        encoder.load_state_dict(self.encoder)
+        set_rng_states(self.rng_states)
+
+        logging.info(f"Resuming AL after the {self.stage} stage of batch {self.batch} with a pool of {len(self.pool)}")
+        return self.pool.copy()
+
+    def update(self, args, batch, stage, pool, encoder, samplek=None, best_trainer_acc=0, best_model=None):
+        self.batch, self.stage = batch, stage
+        self.pool = pool.copy()
+        if samplek is not None:
+            self.selected[batch] = PathLossTable.from_samples(samplek).paths()
+
+        self.encoder = get_state_copy(encoder)
+        self.best_trainer_acc = best_trainer_acc
+        self.best_model = get_state_copy(best_model) if best_model is not None else None
+        self.rng_states = get_rng_states()
+
+        self.save(args)
+
+    def save(self, args):
+        out = get_state_file(args)
+        tmp = f"{out}.tmp"
+
+        try:
+            # written aside and renamed, so a preemption during the save keeps the previous stage
+            torch.save(vars(self), tmp)
+            os.replace(tmp, out)
+
+        except IOError as er:
+            logging.error(er)
+
+    @staticmethod
+    def load(args):
+        """Returns the saved state, or None if there is none."""
+        try:
+            state = ALCycleState()
+            state.__dict__.update(torch.load(get_state_file(args), weights_only=False))
+            return state
+
+        except IOError:
+            return None
+
+
+def get_state_copy(model):
+    return {key: value.detach().cpu().clone() for key, value in model.state_dict().items()}
+
+
+def get_state_file(args):
+    return os.path.join(args.model_checkpoint_path, args.al_state_file)
@@ -0,0 +1,90 @@
+import math
+
+import torch
+import torch.nn as nn
+
+
+def get_head(model):
+    """Returns the name of the last linear layer of the model, whose input is the embedding used by the coreset."""
+    name = None
+    for module_name, module in model.named_modules():
+        if isinstance(module, nn.Linear):
+            name = module_name
+
+    if name is None:
+        raise ValueError(f"{type(model).__name__} has no linear head to take the embeddings from")
+
+    return name
+
+
+class HeadInputs():
+    """Collects the inputs of the last linear layer of a model while it runs."""
+
+    def __init__(self, model) -> None:
+        self.features = []
+        module = dict(model.named_modules())[get_head(model)]
+        self.hook = module.register_forward_hook(lambda module, inputs, output: self.features.append(inputs[0].detach().flatten(1)))
+
+    def remove(self):
+        self.hook.remove()
+        return torch.cat(self.features)
+
+
+def update_min_distances(features, norms, min_distances, centers, block_size):
+    # squared distances of the candidates to the [g, D] centers, block_size of them at a time
+    center_norms = centers.pow(2).sum(dim=1)
+    rows = max(1, block_size // centers.size(0))
+
+    for start in range(0, features.size(0), rows):
+        block = slice(start, start + rows)
+        distances = norms[block, None] - 2 * (features[block] @ centers.t()) + center_norms
+        torch.minimum(min_distances[block], distances.min(dim=1)[0], out=min_distances[block])
+
+
+@torch.no_grad()
+def k_center_greedy(features, k, block_size=16384, projection_dim=0, centers=None, centers_per_update=256):
+    """
+    Greedy k-center selection (the coreset approach of Sener & Savarese). It keeps the
+    distance of every candidate to its closest selected center and updates it block by block
+    after each pick, so it runs in O(N.k.D) time and O(N + block_size.D) extra memory and never
+    builds the N x N distance matrix. The centers are the embeddings of the samples already
+    labeled, the candidates start at their distance to them and the first pick is the farthest
+    one, else it is random. With projection_dim set, the features are first projected onto
+    that many random Gaussian directions, which roughly preserves the distances and makes each
+    update cheaper. Returns the indices in the order they were picked.
+    """
+    features = features.float()
+    n = features.size(0)
+    k = min(k, n)
+    if k == 0:
+        return []
+
+    if centers is not None:
+        centers = centers.float().to(features.device)
+
+    if projection_dim and projection_dim < features.size(1):
+        projection = torch.randn(features.size(1), projection_dim, device=features.device) / math.sqrt(projection_dim)
+        features = torch.cat([block @ projection for block in features.split(block_size)])
+        if centers is not None:
+            centers = torch.cat([block @ projection for block in centers.split(block_size)])
+
+    norms = features.pow(2).sum(dim=1)
+    min_distances = torch.full((n,), float("inf"), device=features.device)
+
+    if centers is not None and centers.size(0) > 0:
+        for group in centers.split(centers_per_update):
+            update_min_distances(features, norms, min_distances, group, block_size)
+
+        index = int(torch.argmax(min_distances))
+    else:
+        index = int(torch.randint(n, (1,)))
+
+    selected = []
+    for _ in range(k):
+        selected.append(index)
+        update_min_distances(features, norms, min_distances, features[index: index + 1], block_size)
+
+        min_distances[index] = -float("inf")
+        index = int(torch.argmax(min_distances))
+
+    return selected
@@ -1,17 +1,21 @@
 from enum import Enum
 import torch
 import torchvision.transforms as transforms
-from typing import List
+from typing import List, Union
 from PIL import Image
 import random
 import glob
-from datautils.path_loss import PathLoss
+from datautils.class_registry import get_class_index, get_dataset_glob
+from datautils.image_store import get_image_source
+from datautils.manifest import get_manifest
+from datautils.path_loss import PathLoss, PathLossTable, get_sample_path
+from datautils.shards import get_shard_dataset
 from models.self_sup.simclr.transformation.simclr_transformations import TransformsSimCLR
 from models.self_sup.simclr.transformation.dcl_transformations import TransformsDCL
-from models.self_sup.swav.transformation.multicropdataset import PILRandomGaussianBlur, get_color_distortion
+from models.self_sup.swav.transformation.multicropdataset import MultiCropTransform
 from models.utils.commons import get_images_pathlist, get_params
 from models.utils.transformations import Transforms
-from utils.commons import load_class_names, pil_loader, save_class_names
+from utils.commons import get_draft_size, pil_loader
 from models.utils.training_type_enum import TrainingType
 from models.utils.ssl_method_enum import SSL_Method
 from datautils.dataset_enum import DatasetType, get_dataset_enum
@@ -22,7 +26,7 @@ labels = {}
 index = 0
 
 class PretextDataLoader():
-    def __init__(self, args, path_loss_list: List[PathLoss], training_type=TrainingType.ACTIVE_LEARNING, is_val=False, batch_size=None) -> None:
+    def __init__(self, args, path_loss_list: Union[PathLossTable, List[PathLoss]], training_type=TrainingType.ACTIVE_LEARNING, is_val=False, batch_size=None, val_subset=True) -> None:
         self.args = args
         self.path_loss_list = path_loss_list
 
@@ -31,29 +35,14 @@ class PretextDataLoader():
 
         self.dir = self.args.dataset_dir + "/" + get_dataset_enum(self.args.target_dataset)
 
-        # This is done to ensure that the dataset used for validation is only a subset of the entire datasets used for training
-        if is_val:
-            val_path_loss_list = []
+        # This is done to ensure that the dataset used for validation is only a subset of the entire datasets used for training.
+        # The AL samplers set val_subset=False, they score the given samples with the validation transforms
+        if is_val and val_subset:
+            img_paths = list(get_manifest(get_dataset_glob(self.args, self.args.target_dataset), self.args.model_misc_path).paths)
 
-            if self.args.target_dataset in [DatasetType.IMAGENET.value, DatasetType.CHEST_XRAY.value]:
-                img_paths = glob.glob(self.dir + '/train/*/*')# img_paths = glob.glob(self.dir + '/train/*/*/*')
-            
-            elif self.args.target_dataset == DatasetType.CIFAR10.value:
-                img_paths = glob.glob(self.args.dataset_dir + '/cifar10v2/train/*/*')
-
-            elif self.args.target_dataset in [DatasetType.UCMERCED.value]:
-                img_paths = glob.glob(self.dir + '/images/*/*')
-
-            elif self.args.target_dataset == DatasetType.MODERN_OFFICE_31.value:
-                img_paths = glob.glob(self.dir + '/*/*/*')
-            
-            else:
-                img_paths = glob.glob(self.dir + '/*/*')
-
-            for path in img_paths[0:len(path_loss_list)]:
-                val_path_loss_list.append(PathLoss(path, 0))     
-
-            self.path_loss_list = val_path_loss_list 
+            # the manifest is sorted by path, so the subset is drawn from a seeded shuffle to span every class
+            random.Random(self.args.seed).shuffle(img_paths)
+            self.path_loss_list = PathLossTable.from_paths(img_paths[0:len(path_loss_list)])
 
         params = get_params(args, training_type)
         self.image_size = params.image_size
@@ -63,17 +52,26 @@ class PretextDataLoader():
 
         # this handles the 2nd pretraining (after AL)
         if self.args.method == SSL_Method.SWAV.value and (self.training_type is not TrainingType.ACTIVE_LEARNING or self.training_type is not TrainingType.BASE_PRETRAIN):
-            dataset = PretextMultiCropDataset(
+            dataset = get_shard_dataset(
                 self.args,
-                self.path_loss_list,
+                MultiCropTransform(self.args.size_crops, self.args.nmb_crops, self.args.min_scale_crops, self.args.max_scale_crops),
+                with_label=False,
+                paths=self.get_paths(),
+                draft_size=get_draft_size(self.args, max(self.args.size_crops)),
             )
 
+            if dataset is None:
+                dataset = PretextMultiCropDataset(
+                    self.args,
+                    self.path_loss_list,
+                )
+
             loader = torch.utils.data.DataLoader(
                 dataset,
                 batch_size=self.batch_size,
                 num_workers=self.args.workers,
                 pin_memory=True,
-                # drop_last=True
+                drop_last=isinstance(dataset, torch.utils.data.IterableDataset),
             )
 
         else:
@@ -93,63 +91,69 @@ class PretextDataLoader():
                 else:
                     ValueError
 
-            dataset = PretextDataset(self.args, self.path_loss_list, transforms, self.is_val)
+            dataset = None
+            if self.training_type != TrainingType.ACTIVE_LEARNING and not self.is_val:
+                dataset = get_shard_dataset(
+                    self.args, transforms, paths=self.get_paths(), 
+                    draft_size=get_draft_size(self.args, self.image_size))
+
+            if dataset is None:
+                dataset = PretextDataset(self.args, self.path_loss_list, transforms, self.is_val, image_size=self.image_size)
+
             loader = torch.utils.data.DataLoader(
                 dataset,
                 batch_size=self.batch_size,
-                shuffle=not self.is_val,
+                shuffle=not self.is_val and not isinstance(dataset, torch.utils.data.IterableDataset),
                 num_workers=self.args.workers,
                 pin_memory=True,
+                drop_last=isinstance(dataset, torch.utils.data.IterableDataset),
             )
 
         print(f"The size of the dataset is {len(dataset)} and the number of batches is {loader.__len__()} for a batch size of {self.batch_size}")
         return loader
 
+    def get_paths(self):
+        if isinstance(self.path_loss_list, PathLossTable):
+            return self.path_loss_list.paths()
+
+        return [get_sample_path(path_loss) for path_loss in self.path_loss_list]
+
 
 class PretextDataset(torch.utils.data.Dataset):
-    def __init__(self, args, pathloss_list: List[PathLoss], transform, is_val=False) -> None:
+    def __init__(self, args, pathloss_list: Union[PathLossTable, List[PathLoss]], transform, is_val=False, image_size=None) -> None:
         self.args = args
         self.pathloss_list = pathloss_list
         self.transform = transform
         self.is_val = is_val
+        self.draft_size = get_draft_size(args, image_size)
 
-        labels = set(load_class_names(self.args))
-        index = 0
-        self.label_dic = {}
-        for label in labels:
-            label = label.replace("\n", "")
-            if label not in self.label_dic:
-                self.label_dic[label] = index
-                index += 1
+        self.label_dic = get_class_index(self.args)
+        self.image_store = get_image_source(self.args)
 
     def __len__(self):
         return len(self.pathloss_list)
 
     def __getitem__(self, idx):
-        path_loss = self.pathloss_list[idx]
-
-        if isinstance(path_loss.path, tuple) or isinstance(path_loss.path, list):
-            path = path_loss.path[0]
-        else:
-            path = path_loss.path
+        path = get_sample_path(self.pathloss_list[idx])
 
-        if self.args.target_dataset in [DatasetType.CHEST_XRAY.value, DatasetType.IMAGENET.value, DatasetType.MODERN_OFFICE_31.value]:
-            img = pil_loader(path)
+        if self.image_store is not None and path in self.image_store:
+            img = self.image_store.load(path)
         else:
-            img = Image.open(path)
+            img = pil_loader(path, self.draft_size)
 
         if self.args.target_dataset == DatasetType.IMAGENET.value:
             label = path.split('/')[-2]
         else:
             label = path.split('/')[-2]
 
-        return self.transform.__call__(img, not self.is_val), torch.tensor(self.label_dic[label])
+        # the pool also holds generated images whose folders are not classes of the target dataset
+        return self.transform.__call__(img, not self.is_val), torch.tensor(self.label_dic.get(label, -1))
 
 class PretextMultiCropDataset(torch.utils.data.Dataset):
     def __init__(
         self,
         args,
-        pathloss_list: List[PathLoss]=None,
+        pathloss_list: Union[PathLossTable, List[PathLoss]]=None,
     ):
         assert len(args.size_crops) == len(args.nmb_crops)
         assert len(args.min_scale_crops) == len(args.nmb_crops)
@@ -157,41 +161,23 @@ class PretextMultiCropDataset(torch.utils.data.Dataset):
 
         self.args = args
         self.pathloss_list = pathloss_list
+        self.image_store = get_image_source(args)
+        self.draft_size = get_draft_size(args, max(args.size_crops))
 
-        color_transform = [get_color_distortion(), PILRandomGaussianBlur()]
-        mean = [0.485, 0.456, 0.406]
-        std = [0.228, 0.224, 0.225]
-        trans = []
-        for i in range(len(args.size_crops)):
-            randomresizedcrop = transforms.RandomResizedCrop(
-                args.size_crops[i],
-                scale=(args.min_scale_crops[i], args.max_scale_crops[i]),
-            )
-            trans.extend([transforms.Compose([
-                randomresizedcrop,
-                transforms.RandomHorizontalFlip(p=0.5),
-                transforms.Compose(color_transform),
-                transforms.ToTensor(),
-                transforms.Normalize(mean=mean, std=std)])
-            ] * args.nmb_crops[i])
-        self.trans = trans
+        self.trans = MultiCropTransform(args.size_crops, args.nmb_crops, args.min_scale_crops, args.max_scale_crops)
 
     def __len__(self):
         return len(self.pathloss_list)
 
     def __getitem__(self, index):
-        path_loss = self.pathloss_list[index]
-        if isinstance(path_loss.path, tuple) or isinstance(path_loss.path, list):
-            path = path_loss.path[0]
-        else:
-            path = path_loss.path
+        path = get_sample_path(self.pathloss_list[index])
 
-        if self.args.target_dataset in [DatasetType.CHEST_XRAY.value, DatasetType.IMAGENET.value, DatasetType.MODERN_OFFICE_31.value]:
-            image = pil_loader(path)
+        if self.image_store is not None and path in self.image_store:
+            image = self.image_store.load(path)
         else:
-            image = Image.open(path)
+            image = pil_loader(path, self.draft_size)
 
-        multi_crops = list(map(lambda trans: trans(image), self.trans))
+        multi_crops = self.trans(image)
         return multi_crops #TODO: Check the len of this multi_crops. Also check if you can use a mined view and an aug view here instead of just aug views.
 
 
@@ -208,18 +194,20 @@ class MakeBatchDataset(torch.utils.data.Dataset):
         self.is_train = is_train
         self.is_tnse = is_tsne
 
-        self.img_path = path_list if path_list is not None else get_images_pathlist(self.dir, with_train)
+        self.img_path = path_list if path_list is not None else get_images_pathlist(self.dir, with_train, args.model_misc_path)
 
         self.transform = transform
+        self.image_store = get_image_source(args)
+        self.draft_size = get_draft_size(args, self.image_size)
 
     def __len__(self):
         return len(self.img_path)
 
     def __getitem__(self, idx):
-        if self.dir in ["./datasets/chest_xray", "./datasets/imagenet", "./datasets/food", "./datasets/modern_office_31"]:
-            img = pil_loader(self.img_path[idx])
+        if self.image_store is not None and self.img_path[idx] in self.image_store:
+            img = self.image_store.load(self.img_path[idx])
         else:
-            img = Image.open(self.img_path[idx])
+            img = pil_loader(self.img_path[idx], self.draft_size)
 
         path = self.img_path[idx] 
         if self.dir == "./datasets/imagenet":
@@ -229,27 +217,9 @@ class MakeBatchDataset(torch.utils.data.Dataset):
 
         if self.is_tnse:
             return img, label
-        
-        save_class_names(self.args, label)
-        
+
+        # the rotated views are built for the whole batch by RotationLoader
         if self.is_train:
-            img = self.transform.__call__(img)
-            img1 = torch.rot90(img, 1, [1,2])
-            img2 = torch.rot90(img, 2, [1,2])
-            img3 = torch.rot90(img, 3, [1,2])
-            imgs = [img, img1, img2, img3]
-            rotations = [0, 1, 2, 3]
-            random.shuffle(rotations)
-
-            return imgs[rotations[0]], imgs[rotations[1]], imgs[rotations[2]], imgs[rotations[3]], rotations[0], rotations[1], rotations[2], rotations[3]
-        else:
-            img = self.transform.__call__(img, False)
-            img1 = torch.rot90(img, 1, [1,2])
-            img2 = torch.rot90(img, 2, [1,2])
-            img3 = torch.rot90(img, 3, [1,2])
-            imgs = [img, img1, img2, img3]
-            rotations = [0, 1, 2, 3]
-            random.shuffle(rotations)
-
-            # print(imgs[rotations[0]].shape, imgs[rotations[1]].shape, imgs[rotations[2]].shape, imgs[rotations[3]].shape)
-            return imgs[rotations[0]], imgs[rotations[1]], imgs[rotations[2]], imgs[rotations[3]], rotations[0], rotations[1], rotations[2], rotations[3], path
\ No newline at end of file
+            return self.transform.__call__(img)
+
+        return self.transform.__call__(img, False), path
\ No newline at end of file
@@ -12,18 +12,26 @@ from models.utils.ssl_method_enum import SSL_Method
 from optim.optimizer import load_optimizer
 import utils.logger as logging
 from typing import List
-import copy
 import random
 
-from datautils.path_loss import PathLoss
+from datautils.manifest import get_image_paths
+from datautils.class_registry import get_class_index
+from datautils.path_loss import PathLoss, PathLossTable, take_samples
 from datautils.target_dataset import get_target_pretrain_ds
-from models.active_learning.pretext_dataloader import PretextDataLoader
+from models.active_learning.pretext_dataloader import PretextDataLoader, PretextDataset
+from models.active_learning.rotation import per_sample_rotation_loss, split_rotations, stack_rotations
+from models.active_learning.al_state import FINETUNED, PRETRAINED, SAMPLED, ALCycleState
+from models.active_learning.acquisition import LogitWriter, select_samples
+from models.active_learning.coreset import HeadInputs, get_head, k_center_greedy
+from models.active_learning.subpool import get_subpool, get_subpool_size, selection_overlap
 from models.backbones.resnet import resnet_backbone
 
+from models.utils.embedding_store import get_embeddings
 from models.utils.commons import AverageMeter, get_ds_num_classes, get_feature_dimensions_backbone, get_model_criterion, get_params
 from models.utils.training_type_enum import TrainingType
 from models.active_learning.al_method_enum import AL_Method, get_al_method_enum
-from utils.commons import load_chkpts, load_path_loss, load_saved_state, save_accuracy_to_file, save_path_loss, simple_load_model, simple_save_model
+from utils.checkpointing import BestStateTracker
+from utils.commons import get_best_state_path, load_chkpts, load_path_loss, load_saved_state, save_accuracy_to_file, save_path_loss, simple_load_model, simple_save_model
 
 class PretextTrainer():
     def __init__(self, args, writer) -> None:
@@ -154,64 +162,92 @@ class PretextTrainer():
 
         return model
 
-    def batch_sampler(self, model, samples: List[PathLoss]) -> List[PathLoss]:
-        loader = PretextDataLoader(self.args, samples, is_val=True, batch_size=1).get_loader()
+    def batch_sampler(self, model, samples: List[PathLoss], top_k=None, name="sampler", pool=None) -> List[PathLoss]:
+        pretext_loader = PretextDataLoader(self.args, samples, is_val=True, batch_size=self.args.al_sampler_batch_size, val_subset=False)
+        loader = pretext_loader.get_loader()
 
-        logging.info(f"Generating the top1 scores using {get_al_method_enum(self.args.al_method)}")
-        _preds = []
+        if self.args.al_method == AL_Method.CORESET.value:
+            return self.coreset_sampler(model, samples, pretext_loader, loader, top_k, pool=pool)
 
-        model.eval()
-        with torch.no_grad():
-            for step, (inputs, _) in enumerate(loader):
-                inputs = inputs.to(self.args.device)
-                outputs = model(inputs)
+        method = get_al_method_enum(self.args.al_method)
+        logging.info(f"Generating the top1 scores using {method}")
 
-                _preds.append(self.get_predictions(outputs))
+        # the logits are streamed to disk, so that the selection of every other acquisition can be derived from them
+        writer = LogitWriter(self.args, pretext_loader.get_paths(), name)
 
-                if step % self.args.log_step == 0:
-                    logging.info(f"Eval Step [{step}/{len(loader)}]")
+        if self.args.embedding_store and isinstance(loader.dataset, PretextDataset):
+            writer.append(get_embeddings(
+                self.args, model, pretext_loader.get_paths(), loader.dataset.transform.test_transform, 
+                draft_size=loader.dataset.draft_size))
 
-        preds = torch.cat(_preds).numpy()
-       
-        return self.get_new_samples(preds, samples)
+        else:
+            model.eval()
+            with torch.no_grad():
+                for step, (inputs, _) in enumerate(loader):
+                    inputs = inputs.to(self.args.device)
+                    writer.append(model(inputs))
 
-    def get_predictions(self, outputs):
-        dist1 = F.softmax(outputs, dim=1)
-        preds = dist1.detach().cpu()
+                    if step % self.args.log_step == 0:
+                        logging.info(f"Eval Step [{step}/{len(loader)}]")
 
-        return preds
+        return self.get_new_samples(select_samples(method, writer.close(), top_k), samples)
 
-    def get_new_samples(self, preds, samples) -> List[PathLoss]:
-        if self.args.al_method == AL_Method.LEAST_CONFIDENCE.value:
-            probs = preds.max(axis=1)
-            indices = probs.argsort(axis=0)
+    def subpool_sampler(self, model, samples: List[PathLoss], top_k=None, name="sampler", pool=None) -> List[PathLoss]:
+        """batch_sampler over a random or stratified subset of the candidates when al_subpool_* is set."""
+        size = get_subpool_size(self.args, len(samples))
+        if size == 0:
+            return self.batch_sampler(model, samples, top_k=top_k, name=name, pool=pool)
 
-        elif self.args.al_method == AL_Method.ENTROPY.value:
-            entropy = (np.log(preds) * preds).sum(axis=1) * -1.
-            indices = entropy.argsort(axis=0)[::-1]
+        logging.info(f"Scoring a {self.args.al_subpool_mode} subpool of {size} out of {len(samples)} candidates")
+        samplek = self.batch_sampler(model, get_subpool(self.args, samples, size), top_k=top_k, name=name, pool=pool)
 
-        elif self.args.al_method == AL_Method.BOTH.value:
-            probs = preds.max(axis=1)
-            indices1 = probs.argsort(axis=0)
+        if self.args.al_subpool_report:
+            full_samplek = self.batch_sampler(model, samples, top_k=top_k, name=f"{name}_full", pool=pool)
+            logging.info(f"The subpool selection shares {selection_overlap(samplek, full_samplek) * 100:.1f}% of the full pool selection")
 
-            entropy = (np.log(preds) * preds).sum(axis=1) * -1.
-            indices2 = entropy.argsort(axis=0)[::-1]
+        return samplek
 
-            indices = np.concatenate((indices1, indices2)) 
-            random.shuffle(indices)
-            indices = indices[: (len(indices)//2)]
+    def get_head_inputs(self, model, pretext_loader, loader):
+        """Embeddings of the samples of the loader at the input of the last linear layer of the model."""
+        if self.args.embedding_store and isinstance(loader.dataset, PretextDataset):
+            return get_embeddings(
+                self.args, model, pretext_loader.get_paths(), loader.dataset.transform.test_transform, 
+                layer=f"{get_head(model)}:input", draft_size=loader.dataset.draft_size).to(self.args.device)
 
-        else:
-            raise ValueError(f"'{self.args.al_method}' method doesn't exist")
+        head_inputs = HeadInputs(model)
+
+        model.eval()
+        with torch.no_grad():
+            for step, (inputs, _) in enumerate(loader):
+                model(inputs.to(self.args.device))
+
+                if step % self.args.log_step == 0:
+                    logging.info(f"Eval Step [{step}/{len(loader)}]")
+
+        return head_inputs.remove()
+
+    def coreset_sampler(self, model, samples: List[PathLoss], pretext_loader, loader, top_k=None, pool=None) -> List[PathLoss]:
+        logging.info(f"Selecting a coreset of {top_k or len(samples)} samples with k-center greedy")
+        features = self.get_head_inputs(model, pretext_loader, loader)
+
+        # the candidates closest to the samples already in the pool are the least informative
+        centers = None
+        if pool is not None and len(pool) > 0:
+            logging.info(f"Measuring the candidates against the {len(pool)} samples of the pool")
+            pool_loader = PretextDataLoader(self.args, pool, is_val=True, batch_size=self.args.al_sampler_batch_size, val_subset=False)
+            centers = self.get_head_inputs(model, pool_loader, pool_loader.get_loader())
+
+        indices = k_center_greedy(
+            features, top_k or len(samples), centers=centers,
+            block_size=self.args.coreset_block_size, projection_dim=self.args.coreset_projection_dim)
 
-        new_samples = []
-        for item in indices:
-            new_samples.append(samples[item]) # Map back to original indices
+        return self.get_new_samples(indices, samples)
 
-        return new_samples
+    def get_new_samples(self, indices, samples) -> List[PathLoss]:
+        return take_samples(samples, indices) # Map back to original indices
 
     def make_batches(self, model, prefix, training_type=TrainingType.ACTIVE_LEARNING):
-        loader = get_target_pretrain_ds(self.args, training_type=training_type, is_train=False, batch_size=1).get_loader()
+        loader = get_target_pretrain_ds(self.args, training_type=training_type, is_train=False, batch_size=self.args.al_sampler_batch_size).get_loader()
 
         model, criterion = get_model_criterion(self.args, model, num_classes=4)
         state = simple_load_model(self.args, path=f'{prefix}_finetuner.pth')
@@ -223,38 +259,35 @@ class PretextTrainer():
         test_loss = 0
         correct = 0
         total = 0
-        pathloss = []
+        sample_paths, losses = [], []
 
         logging.info("About to begin eval to make batches")
         with torch.no_grad():
-            for step, (inputs, inputs1, inputs2, inputs3, targets, targets1, targets2, targets3, path) in enumerate(loader):
-                inputs, inputs1, targets, targets1 = inputs.to(self.args.device), inputs1.to(self.args.device), targets.to(self.args.device), targets1.to(self.args.device)
-                inputs2, inputs3, targets2, targets3 = inputs2.to(self.args.device), inputs3.to(self.args.device), targets2.to(self.args.device), targets3.to(self.args.device)
+            for step, (inputs, inputs1, inputs2, inputs3, targets, targets1, targets2, targets3, paths) in enumerate(loader):
+                inputs, targets = stack_rotations((inputs, inputs1, inputs2, inputs3), (targets, targets1, targets2, targets3), self.args.device)
                 outputs = model(inputs)
-                outputs1 = model(inputs1)
-                outputs2 = model(inputs2)
-                outputs3 = model(inputs3)
-                loss1 = criterion(outputs, targets)
-                loss2 = criterion(outputs1, targets1)
-                loss3 = criterion(outputs2, targets2)
-                loss4 = criterion(outputs3, targets3)
-                loss = (loss1+loss2+loss3+loss4)/4.
-                test_loss += loss.item()
-                _, predicted = outputs.max(1)
-                total += targets.size(0)
-                correct += predicted.eq(targets).sum().item()
 
-                loss = loss.item()
+                sample_losses = per_sample_rotation_loss(outputs, targets)
+                test_loss += sample_losses.sum().item()
+
+                _, predicted = split_rotations(outputs)[0].max(1)
+                total += predicted.size(0)
+                correct += predicted.eq(split_rotations(targets)[0]).sum().item()
 
                 if step % self.args.log_step == 0:
-                    logging.info(f"Eval Step [{step}/{len(loader)}]\t Loss: {loss}")
+                    logging.info(f"Eval Step [{step}/{len(loader)}]\t Loss: {sample_losses.mean().item()}")
 
-                if isinstance(path, tuple) or isinstance(path, list):
-                    path = path[0]
+                if isinstance(paths, str):
+                    paths = [paths]
 
-                pathloss.append(PathLoss(path, loss))
-        
-        sorted_samples = sorted(pathloss, key=lambda x: x.loss, reverse=True)
+                sample_paths.extend(paths)
+                losses.append(sample_losses.float().cpu())
+
+        class_index = get_class_index(self.args)
+        labels = [class_index.get(path.split('/')[-2], -1) for path in sample_paths]
+        pathloss = PathLossTable.from_paths(sample_paths, torch.cat(losses).numpy(), labels)
+
+        sorted_samples = pathloss.sort(reverse=True)
         save_path_loss(self.args, self.args.al_path_loss_file, sorted_samples)
 
         return sorted_samples
@@ -270,30 +303,14 @@ class PretextTrainer():
         total_steps = 0
         with torch.no_grad():
             for step, (inputs, inputs1, inputs2, inputs3, targets, targets1, targets2, targets3) in enumerate(test_loader):
-                inputs, inputs1, targets, targets1 = inputs.to(self.args.device), inputs1.to(self.args.device), targets.to(self.args.device), targets1.to(self.args.device)
-                inputs2, inputs3, targets2, targets3 = inputs2.to(self.args.device), inputs3.to(self.args.device), targets2.to(self.args.device), targets3.to(self.args.device)
-                
-                outputs = model(inputs)
-                outputs1 = model(inputs1)
-                outputs2 = model(inputs2)
-                outputs3 = model(inputs3)
+                inputs, targets = stack_rotations((inputs, inputs1, inputs2, inputs3), (targets, targets1, targets2, targets3), self.args.device)
 
-                loss = criterion(outputs, targets)
-                loss1 = criterion(outputs1, targets1)
-                loss2 = criterion(outputs2, targets2)
-                loss3 = criterion(outputs3, targets3)
-                loss_avg = (loss + loss1 + loss2 + loss3) / 4.
+                outputs = model(inputs)
+                loss_avg = criterion(outputs, targets)
 
                 _, predicted = outputs.max(1)
-                _, predicted1 = outputs1.max(1)
-                _, predicted2 = outputs2.max(1)
-                _, predicted3 = outputs3.max(1)
-                total += targets.size(0)*4
-
+                total += targets.size(0)
                 correct += predicted.eq(targets).sum().item()
-                correct += predicted1.eq(targets1).sum().item()
-                correct += predicted2.eq(targets2).sum().item()
-                correct += predicted3.eq(targets3).sum().item()
 
                 losses.update(loss_avg.item(), inputs[0].size(0))
                 
@@ -307,7 +324,10 @@ class PretextTrainer():
         epoch_acc = 100. * correct / total
 
         if epoch_acc > self.best_trainer_acc:
-            self.best_model = copy.deepcopy(model)
+            if self.best_model is None:
+                self.best_model = BestStateTracker(model, path=get_best_state_path(self.args, "finetuner"))
+
+            self.best_model.update(model)
             self.best_trainer_acc = epoch_acc
 
         avg_loss = losses.sum/total_steps
@@ -336,19 +356,13 @@ class PretextTrainer():
             if self.args.al_optimizer == "SwAV":
                 scheduler.step(epoch, step)
 
-            inputs, inputs1 = inputs.to(self.args.device), inputs1.to(self.args.device)
-            targets, targets1 = targets.to(self.args.device), targets1.to(self.args.device)
-            inputs2, inputs3 = inputs2.to(self.args.device), inputs3.to(self.args.device)
-            targets2, targets3 = targets2.to(self.args.device), targets3.to(self.args.device)
+            inputs, targets = stack_rotations((inputs, inputs1, inputs2, inputs3), (targets, targets1, targets2, targets3), self.args.device)
 
             optimizer.zero_grad()
-            outputs, outputs1, outputs2, outputs3 = model(inputs), model(inputs1), model(inputs2), model(inputs3)
+            outputs = model(inputs)
 
-            loss = criterion(outputs, targets)
-            loss1 = criterion(outputs1, targets1)
-            loss2 = criterion(outputs2, targets2)
-            loss3 = criterion(outputs3, targets3)
-            loss_avg = (loss + loss1 + loss2 + loss3) / 4.
+            # the four rotations have the same size, so the mean over 4B equals the mean of the four losses
+            loss_avg = criterion(outputs, targets)
             loss_avg.backward()
             optimizer.step()
 
@@ -376,9 +390,12 @@ class PretextTrainer():
         logging.info("Train Loss: {:.4f}".format(avg_loss))
         return avg_loss
 
-    def finetuner_new(self, model, prefix, path_list: List[PathLoss], training_type=TrainingType.ACTIVE_LEARNING):
+    def finetuner_new(self, model, prefix, path_list: List[PathLoss], training_type=TrainingType.ACTIVE_LEARNING, new_paths=None, previous_prefix=None):
+        if self.args.al_incremental_finetune and path_list is not None and new_paths is not None:
+            return self.incremental_finetuner(model, prefix, path_list, new_paths, previous_prefix, training_type)
+
         if path_list is not None:
-            path_list = [path.path for path in path_list]
+            path_list = PathLossTable.from_samples(path_list).paths()
 
             train_loader, test_loader = get_target_pretrain_ds(self.args, training_type=training_type).get_finetuner_loaders(
                 train_batch_size=self.args.al_finetune_batch_size, val_batch_size=100, path_list=path_list
@@ -395,8 +412,40 @@ class PretextTrainer():
         train_params = get_params(self.args, TrainingType.ACTIVE_LEARNING)
         optimizer, scheduler = load_optimizer(self.args, model.parameters(), train_params=train_params, train_loader=train_loader)
 
+        self.run_finetuner(model, criterion, optimizer, scheduler, train_loader, test_loader, self.args.al_finetune_trainer_epochs)
+        simple_save_model(self.args, self.best_model, f'{prefix}_finetuner.pth')
+
+    def incremental_finetuner(self, model, prefix, path_list: List[PathLoss], new_paths, previous_prefix=None, training_type=TrainingType.ACTIVE_LEARNING):
+        """
+        finetuner_new for a pool that grew by new_paths since the previous batch: the rotation
+        head starts from the {previous_prefix}_finetuner.pth one, the train/val split is stable
+        across batches and an epoch replays the new paths more often than the seen ones, for
+        al_incremental_epochs epochs.
+        """
+        train_loader, test_loader = get_target_pretrain_ds(self.args, training_type=training_type).get_incremental_finetuner_loaders(
+            train_batch_size=self.args.al_finetune_batch_size, val_batch_size=100,
+            path_list=PathLossTable.from_samples(path_list).paths(), new_paths=new_paths
+        )
+
+        model, criterion = get_model_criterion(self.args, model, num_classes=4)
+
+        state = simple_load_model(self.args, path=f'{previous_prefix}_finetuner.pth') if previous_prefix is not None else None
+        if state:
+            logging.info(f"Warm starting the rotation head from {previous_prefix}_finetuner.pth")
+            model.linear.load_state_dict({key[len("linear."):]: value for key, value in state['model'].items() if key.startswith("linear.")})
+
+        model = model.to(self.args.device)
+
+        train_params = get_params(self.args, TrainingType.ACTIVE_LEARNING)
+        optimizer, scheduler = load_optimizer(self.args, model.parameters(), train_params=train_params, train_loader=train_loader)
+
+        # the best model has to come from this batch, the encoder changed since the previous one
+        self.best_trainer_acc = 0
+        self.run_finetuner(model, criterion, optimizer, scheduler, train_loader, test_loader, self.args.al_incremental_epochs)
+        simple_save_model(self.args, self.best_model, f'{prefix}_finetuner.pth')
+
+    def run_finetuner(self, model, criterion, optimizer, scheduler, train_loader, test_loader, epochs):
         counter = 0
-        epochs = self.args.al_finetune_trainer_epochs
         logging.info("Running finetuner")
         for epoch in range(epochs):
             logging.info('\nEpoch {}/{}'.format(epoch, epochs))
@@ -418,8 +467,6 @@ class PretextTrainer():
                 logging.info("Early stopped at epoch {}:".format(epoch))
                 break
 
-        simple_save_model(self.args, self.best_model, f'{prefix}_finetuner.pth')
-
     def finetuner(self, model, prefix, training_type=TrainingType.ACTIVE_LEARNING):
         train_loader, test_loader = get_target_pretrain_ds(
             self.args, training_type=training_type).get_finetuner_loaders(
@@ -479,13 +526,18 @@ class PretextTrainer():
         model.load_state_dict(state['model'], strict=False)
         model = model.to(self.args.device)
 
-        samplek = self.batch_sampler(model, path_loss)
+        samplek = self.batch_sampler(model, path_loss, name="distill_gen")
 
         # this does a reverse active learning to pick only the most certain data
         samplek = samplek[::-1] # commenting this because I want to pick only the uninformative samples
         return samplek[: int(len(samplek) * self.args.al_gen_sample_percentage)]
 
     def do_active_learning(self) -> List[PathLoss]:
+        if self.args.al_resume:
+            state = ALCycleState.load(self.args)
+            if state is not None:
+                return self.resume_active_learning(state)
+
         encoder = resnet_backbone(self.args.backbone, pretrained=False)
         
         state = simple_load_model(self.args, path='first_finetuner.pth')
@@ -502,23 +554,39 @@ class PretextTrainer():
 
         return self.active_learning_new(path_loss, encoder)
 
+    def resume_active_learning(self, state=None) -> List[PathLoss]:
+        """Continues active_learning_new from the last stage saved in al_state_file."""
+        state = state or ALCycleState.load(self.args)
+        if state is None:
+            raise ValueError(f"No AL state to resume from in {self.args.model_checkpoint_path}")
+
+        encoder = resnet_backbone(self.args.backbone, pretrained=False)
+        path_loss = load_path_loss(self.args, self.args.al_path_loss_file)
+        if path_loss is None:
+            # the candidates are ranked again by the first finetuner, the saved state then
+            # overwrites the encoder weights it loaded
+            logging.info(f"No {self.args.al_path_loss_file} to resume from, ranking the candidates again")
+            path_loss = self.make_batches(encoder, prefix='first')
+
+        return self.active_learning_new(path_loss, encoder, state=state)
+
     def ds_distillation(self, encoder, path_loss):
         model, _ = get_model_criterion(self.args, encoder, num_classes=4)
         state = simple_load_model(self.args, path='first_finetuner.pth')
         model.load_state_dict(state['model'], strict=False)
         model = model.to(self.args.device)
 
-        samplek = self.batch_sampler(model, path_loss)
+        samplek = self.batch_sampler(model, path_loss, name="distillation")
 
         # this does a reverse active learning to pick only the most certain data
         samplek = samplek[::-1]
         return samplek[: int(len(samplek) * self.args.al_sample_percentage)]
 
-    def active_learning_new(self, path_loss, encoder):
-        pretraining_sample_pool = []
+    def active_learning_new(self, path_loss, encoder, state=None):
+        pretraining_sample_pool = PathLossTable.from_paths([])
 
-        gen_images = glob.glob(f'{self.args.dataset_dir}/{self.args.base_dataset}/*')
-        pretraining_gen_images = [PathLoss(path, 0) for path in gen_images]
+        gen_images = get_image_paths(f'{self.args.dataset_dir}/{self.args.base_dataset}/*', self.args.model_misc_path)
+        pretraining_gen_images = PathLossTable.from_paths(gen_images)
         pretraining_sample_pool.extend(pretraining_gen_images) #TODO Uncomment this if new idea does not work
 
 
@@ -534,6 +602,21 @@ class PretextTrainer():
 
         logging.info(f"Size of pretraining_sample_pool is {len(pretraining_sample_pool)}")
 
+        # the state is saved after every stage of a batch, a resumed run skips the completed ones
+        if state is None:
+            state = ALCycleState()
+        else:
+            pretraining_sample_pool = state.restore(encoder)
+
+            # the finetuners of the next batches compare against the best accuracy seen so far
+            self.best_trainer_acc = state.best_trainer_acc
+            if state.best_model is not None:
+                self.best_model = BestStateTracker(encoder, path=get_best_state_path(self.args, "finetuner"))
+                self.best_model.load_state_dict(state.best_model)
+
+        if path_loss is None:
+            raise ValueError(f"No ranked candidates in {self.args.al_path_loss_file}, make_batches has to run first")
+
         path_loss = path_loss[::-1] # this does a reverse active learning to pick only the most certain data
         sample_per_batch = len(path_loss)//self.args.al_batches
 
@@ -543,6 +626,9 @@ class PretextTrainer():
         # target_pool = []
 
         for batch in range(self.args.al_batches):
+            if state.is_done(batch, FINETUNED):
+                continue
+
             sample6400 = path_loss[batch * sample_per_batch : (batch + 1) * sample_per_batch]
 
             # # this is for the new idea
@@ -551,42 +637,57 @@ class PretextTrainer():
             # pretraining_sample_pool = []
             # ################################
 
-            if batch > 0:
-                logging.info(f'>> Getting best checkpoint for batch {batch + 1}')
+            if not state.is_done(batch, SAMPLED):
+                if batch > 0:
+                    logging.info(f'>> Getting best checkpoint for batch {batch + 1}')
 
-                state = simple_load_model(self.args, path=f'{batch-1}_finetuner.pth')
+                    finetuner_state = simple_load_model(self.args, path=f'{batch-1}_finetuner.pth')
 
-                batch_sampler_encoder.load_state_dict(state['model'], strict=False)
+                    batch_sampler_encoder.load_state_dict(finetuner_state['model'], strict=False)
 
-                # sampling
-                samplek = self.batch_sampler(batch_sampler_encoder, sample6400)[:self.args.al_trainer_sample_size]
-                batch_sampler_encoder = encoder
-            else:
-                # first iteration: sample k at even intervals
-                samplek = sample6400[:self.args.al_trainer_sample_size]
+                    # sampling
+                    samplek = self.subpool_sampler(
+                        batch_sampler_encoder, sample6400, top_k=self.args.al_trainer_sample_size, name=f"{batch}_sampler",
+                        pool=pretraining_sample_pool)
+                    batch_sampler_encoder = encoder
+                else:
+                    # first iteration: sample k at even intervals
+                    samplek = sample6400[:self.args.al_trainer_sample_size]
 
-            # # this is for the new idea
-            # target_pool.extend(samplek)
-            # pretraining_sample_pool.extend(pretraining_gen_images)
-            # pretraining_sample_pool.extend(target_pool)
-            # ################################
+                # # this is for the new idea
+                # target_pool.extend(samplek)
+                # pretraining_sample_pool.extend(pretraining_gen_images)
+                # pretraining_sample_pool.extend(target_pool)
+                # ################################
 
-            pretraining_sample_pool.extend(samplek) #TODO Uncomment this if new idea does not work
+                pretraining_sample_pool.extend(samplek) #TODO Uncomment this if new idea does not work
+                state.update(
+                    self.args, batch, SAMPLED, pretraining_sample_pool, encoder, samplek,
+                    best_trainer_acc=self.best_trainer_acc, best_model=self.best_model)
 
             logging.info(f"Size of pretraining_sample_pool is {len(pretraining_sample_pool)}")
 
-            loader = PretextDataLoader(self.args, pretraining_sample_pool, training_type=TrainingType.BASE_PRETRAIN).get_loader()
-            pretrainer = SelfSupPretrainer(self.args, self.writer)
-            pretrainer.base_pretrain(encoder, loader, self.args.base_epochs, trainingType=TrainingType.BASE_PRETRAIN)
+            if not state.is_done(batch, PRETRAINED):
+                loader = PretextDataLoader(self.args, pretraining_sample_pool, training_type=TrainingType.BASE_PRETRAIN).get_loader()
+                pretrainer = SelfSupPretrainer(self.args, self.writer)
+                pretrainer.base_pretrain(encoder, loader, self.args.base_epochs, trainingType=TrainingType.BASE_PRETRAIN)
+                state.update(
+                    self.args, batch, PRETRAINED, pretraining_sample_pool, encoder,
+                    best_trainer_acc=self.best_trainer_acc, best_model=self.best_model)
 
             if batch < self.args.al_batches - 1: # I want this not to happen for the last iteration since it would be needless
-                self.finetuner_new(encoder, prefix=str(batch), path_list=pretraining_sample_pool, training_type=TrainingType.BASE_PRETRAIN)
+                self.finetuner_new(
+                    encoder, prefix=str(batch), path_list=pretraining_sample_pool, training_type=TrainingType.BASE_PRETRAIN,
+                    new_paths=state.selected.get(batch), previous_prefix=str(batch - 1) if batch > 0 else None)
+                state.update(
+                    self.args, batch, FINETUNED, pretraining_sample_pool, encoder,
+                    best_trainer_acc=self.best_trainer_acc, best_model=self.best_model)
 
         
         return pretraining_sample_pool
     
     def active_learning(self, path_loss):
-        pretraining_sample_pool = []
+        pretraining_sample_pool = PathLossTable.from_paths([])
         rebuild_al_model = True
 
         sample_per_batch = len(path_loss)//self.args.al_batches
@@ -600,7 +701,9 @@ class PretextTrainer():
                 main_task_model.load_state_dict(state['model'], strict=False)
 
                 # sampling
-                samplek = self.batch_sampler(main_task_model, sample6400)[:self.args.al_trainer_sample_size]
+                samplek = self.subpool_sampler(
+                    main_task_model, sample6400, top_k=self.args.al_trainer_sample_size, name=f"proxy_{batch}_sampler",
+                    pool=pretraining_sample_pool)
             else:
                 # first iteration: sample k at even intervals
                 samplek = sample6400[:self.args.al_trainer_sample_size]
@@ -0,0 +1,84 @@
+import torch
+import torch.nn.functional as F
+
+NUM_ROTATIONS = 4
+
+
+def stack_rotations(views, targets, device):
+    """
+    Stacks the four rotated views of a batch into a single [4B, C, H, W] tensor (and the
+    matching [4B] targets) so that the model runs one forward pass instead of four.
+    """
+    inputs = torch.cat(views).to(device, non_blocking=True)
+    targets = torch.cat([torch.as_tensor(target) for target in targets]).to(device, non_blocking=True)
+
+    return inputs, targets
+
+
+def split_rotations(outputs):
+    """Splits the logits of a stacked rotation batch back into one chunk per rotation."""
+    return outputs.chunk(NUM_ROTATIONS)
+
+
+def per_sample_rotation_loss(outputs, targets):
+    """Averages the cross entropy of the four rotations of every sample in the batch."""
+    loss = F.cross_entropy(outputs, targets, reduction='none')
+    return loss.view(NUM_ROTATIONS, -1).mean(dim=0)
+
+
+def rotate_batch(batch):
+    """
+    Builds the rotated views and labels of a whole batch of unrotated images. Every sample
+    gets its own random order of the four rotations, as the per-sample shuffle used to do,
+    and the result keeps the (img, img1, img2, img3, rot, rot1, rot2, rot3[, path]) layout.
+    """
+    paths = None
+    if isinstance(batch, (tuple, list)):
+        images, paths = batch
+    else:
+        images = batch
+
+    batch_size = images.size(0)
+    rotated = torch.stack([torch.rot90(images, k, [2, 3]) for k in range(NUM_ROTATIONS)])
+
+    rotations = torch.argsort(torch.rand(batch_size, NUM_ROTATIONS), dim=1).t()
+    views = rotated[rotations, torch.arange(batch_size)]
+
+    outputs = (*views.unbind(0), *rotations.unbind(0))
+    if paths is not None:
+        outputs += (paths,)
+
+    return outputs
+
+
+class Rotate():
+    """Rotates an image tensor by k * 90 degrees, as the k-th view of the rotation pretext task."""
+
+    def __init__(self, k) -> None:
+        self.k = k
+
+    def __call__(self, image):
+        return torch.rot90(image, self.k, [1, 2])
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(k={self.k})"
+
+
+class RotationLoader():
+    """
+    Wraps a DataLoader whose dataset returns one image per sample and applies the rotation
+    pretext task to every batch in the main process, so that the workers only send a single
+    image per sample over IPC instead of four.
+    """
+
+    def __init__(self, loader) -> None:
+        self.loader = loader
+        self.dataset = loader.dataset
+        self.batch_size = loader.batch_size
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        for batch in self.loader:
+            yield rotate_batch(batch)
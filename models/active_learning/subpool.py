@@ -0,0 +1,70 @@
+import random
+from collections import defaultdict
+from typing import List
+
+import numpy as np
+
+from datautils.path_loss import PathLoss, PathLossTable, get_sample_path, take_samples
+import utils.logger as logging
+
+
+def get_subpool_size(args, pool_size):
+    """
+    Number of candidates to score, al_subpool_size or a multiple of the AL budget, at least the
+    budget itself. 0 scores them all.
+    """
+    size = args.al_subpool_size
+    if args.al_subpool_budget_multiple > 0:
+        size = args.al_subpool_budget_multiple * args.al_trainer_sample_size
+
+    if 0 < size < args.al_trainer_sample_size:
+        logging.info(f"A subpool of {size} is smaller than the budget, {args.al_trainer_sample_size} candidates are scored instead")
+        size = args.al_trainer_sample_size
+
+    return size if 0 < size < pool_size else 0
+
+
+def get_sample_classes(samples):
+    if isinstance(samples, PathLossTable) and (samples.labels >= 0).all():
+        return samples.labels.tolist()
+
+    return [get_sample_path(sample).split('/')[-2] for sample in samples]
+
+
+def random_subpool(samples: List[PathLoss], size) -> List[PathLoss]:
+    return take_samples(samples, random.sample(range(len(samples)), size))
+
+
+def stratified_subpool(samples: List[PathLoss], size) -> List[PathLoss]:
+    # every class (the folder of the image) keeps its share of the pool, the rounding
+    # leftovers are drawn at random from the samples not picked yet
+    classes = defaultdict(list)
+    for idx, label in enumerate(get_sample_classes(samples)):
+        classes[label].append(idx)
+
+    indices = []
+    for members in classes.values():
+        indices.extend(random.sample(members, len(members) * size // len(samples)))
+
+    rest = np.setdiff1d(np.arange(len(samples)), indices).tolist()
+    indices.extend(random.sample(rest, size - len(indices)))
+
+    return take_samples(samples, indices)
+
+
+def get_subpool(args, samples: List[PathLoss], size) -> List[PathLoss]:
+    if args.al_subpool_mode == "random":
+        return random_subpool(samples, size)
+
+    elif args.al_subpool_mode == "stratified":
+        return stratified_subpool(samples, size)
+
+    raise ValueError(f"'{args.al_subpool_mode}' subpool mode doesn't exist")
+
+
+def selection_overlap(selected: List[PathLoss], reference: List[PathLoss]):
+    """Fraction of the reference selection that was also selected."""
+    if not reference:
+        return 1.0
+
+    return len(set(map(get_sample_path, selected)) & set(map(get_sample_path, reference))) / len(reference)
@@ -6,6 +6,8 @@ import torch.utils.data as data
 from torch.utils.data import Dataset
 from PIL import Image
 from copy import deepcopy
+from datautils.lmdb_dataset import LMDBStore
+from datautils.manifest import get_image_paths
 import shutil
 import json
 import random
@@ -69,7 +71,7 @@ class  ImageFolder(Dataset):
 
     def _parse_frame2(self):
         print(self.dir)
-        img_path = glob.glob(self.dir + '/*/*')
+        img_path = get_image_paths(self.dir + '/*/*')
         return img_path
 
     def _parse_frame(self):
@@ -82,9 +84,9 @@ class  ImageFolder(Dataset):
         print(self.dir)
 
         if self.dataset == "modern_office_31":
-            img_path = glob.glob(self.dir + '/*/*/*')
+            img_path = get_image_paths(self.dir + '/*/*/*')
         else:
-            img_path = glob.glob(self.dir + '/*/*')
+            img_path = get_image_paths(self.dir + '/*/*')
 
         # mixing the dataset with some source proxy
         # source_proxy = glob.glob(f'datasets/cifar10/train/*/*')
@@ -112,44 +114,20 @@ class  ImageFolder(Dataset):
 
 
 
-# from io import BytesIO
-# import lmdb
-# from torch.utils.data import Dataset
-
-
-# class MultiResolutionDataset(Dataset):
-#     def __init__(self, path, transform, resolution=256):
-#         self.env = lmdb.open(
-#             path,
-#             max_readers=32,
-#             readonly=True,
-#             lock=False,
-#             readahead=False,
-#             meminit=False,
-#         )
-
-#         if not self.env:
-#             raise IOError('Cannot open lmdb dataset', path)
-
-#         with self.env.begin(write=False) as txn:
-#             self.length = int(txn.get('length'.encode('utf-8')).decode('utf-8'))
-
-#         self.resolution = resolution
-#         self.transform = transform
-
-#     def __len__(self):
-#         return self.length
+class MultiResolutionDataset(Dataset):
+    """Images of one resolution of an lmdb dataset written by prepare_data.py"""
+    def __init__(self, path, transform, resolution=256):
+        super(MultiResolutionDataset, self).__init__()
+        self.store = LMDBStore(path, resolution)
+        self.transform = transform
 
-#     def __getitem__(self, index):
-#         with self.env.begin(write=False) as txn:
-#             key = f'{self.resolution}-{str(index).zfill(5)}'.encode('utf-8')
-#             img_bytes = txn.get(key)
-#             #key_asp = f'aspect_ratio-{str(index).zfill(5)}'.encode('utf-8')
-#             #aspect_ratio = float(txn.get(key_asp).decode())
+    def __len__(self):
+        return len(self.store)
 
-#         buffer = BytesIO(img_bytes)
-#         img = Image.open(buffer)
-#         img = self.transform(img)
+    def __getitem__(self, idx):
+        img = self.store.get(idx)
 
-#         return img
+        if self.transform:
+            img = self.transform(img)
 
+        return img
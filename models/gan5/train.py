@@ -14,7 +14,7 @@ from tqdm import tqdm
 from datautils.dataset_enum import get_dataset_enum
 
 from models.gan5.models import weights_init, Discriminator, Generator
-from models.gan5.operation import copy_G_params, load_params, get_dir, ImageFolder, InfiniteSamplerWrapper
+from models.gan5.operation import copy_G_params, load_params, get_dir, ImageFolder, InfiniteSamplerWrapper, MultiResolutionDataset
 from models.gan5.diffaug import DiffAugment
 import models.gan5.lpips.utils as lpips
 import utils.logger as logging
@@ -83,9 +83,8 @@ def train(args):
         ]
     trans = transforms.Compose(transform_list)
     
-    if 'lmdb' in args.path:
-        from operation import MultiResolutionDataset
-        dataset = MultiResolutionDataset(args.path, trans, 1024)
+    if args.lmdb_path:
+        dataset = MultiResolutionDataset(args.lmdb_path, trans, args.lmdb_resolution)
     else:
         dataset = ImageFolder(args.path, transform=trans)
 
@@ -249,10 +248,14 @@ def do_gen_ai(args):
     parser.add_argument('--batch_size', type=int, default=8, help='mini batch number of images')
     parser.add_argument('--im_size', type=int, default=1024, help='image resolution')
     parser.add_argument('--ckpt', type=str, default=None, help='checkpoint weight path if have one')
+    parser.add_argument('--lmdb_path', type=str, default='', help='lmdb dataset written by prepare_data.py to read instead of the image folder')
+    parser.add_argument('--lmdb_resolution', type=int, default=1024, help='resolution of the lmdb images to read')
 
     gen_args = parser.parse_args()
 
     gen_args.path = get_dataset_enum(args.target_dataset)
+    gen_args.lmdb_path = args.lmdb_path
+    gen_args.lmdb_resolution = args.lmdb_resolution
 
     train(gen_args)
 
@@ -0,0 +1,49 @@
+import functools
+
+import torch
+from torch.utils.checkpoint import checkpoint
+
+
+@functools.lru_cache(maxsize=32)
+def get_exclusion_mask(b, n, offsets, fill, device, dtype):
+    """[b, n] additive mask holding fill at the columns i + offset of every row i, built once per shape and device."""
+    mask = torch.zeros(b, n, device=device, dtype=dtype)
+    rows = torch.arange(b, device=device)
+    for offset in offsets:
+        mask[rows, rows + offset] = fill
+
+    return mask
+
+
+def masked_logsumexp(anchor, contrast, temperature, offsets, fill, start=0):
+    # rows start... of the similarity matrix, with fill added to the excluded columns like the mask does
+    similarity = torch.matmul(anchor, contrast.t()) / temperature
+
+    rows = torch.arange(anchor.size(0), device=anchor.device)
+    fill = torch.tensor(fill, device=anchor.device, dtype=similarity.dtype)
+    for offset in offsets:
+        similarity = similarity.index_put((rows, rows + start + offset), fill, accumulate=True)
+
+    return torch.logsumexp(similarity, dim=1)
+
+
+def contrastive_logsumexp(anchor, contrast, temperature, offsets=(0,), fill=float("-inf"), chunk_size=0):
+    """
+    logsumexp over j of anchor_i . contrast_j / temperature, for every row i, where fill is
+    added to the columns i + offset (-inf drops them). With chunk_size set, the rows are computed
+    block by block and each block is recomputed during the backward pass, so only a
+    [chunk_size, len(contrast)] block of similarities is alive at a time instead of the whole matrix.
+    """
+    b = anchor.size(0)
+    if chunk_size <= 0 or chunk_size >= b:
+        similarity = torch.matmul(anchor, contrast.t()) / temperature
+        mask = get_exclusion_mask(b, contrast.size(0), tuple(offsets), fill, anchor.device, similarity.dtype)
+        return torch.logsumexp(similarity + mask, dim=1)
+
+    blocks = []
+    for start in range(0, b, chunk_size):
+        blocks.append(checkpoint(
+            masked_logsumexp, anchor[start: start + chunk_size], contrast, temperature, tuple(offsets), fill, start,
+            use_reentrant=False))
+
+    return torch.cat(blocks)
@@ -1,6 +1,8 @@
 import torch
 import numpy as np
 
+from models.self_sup.simclr.loss.contrastive import contrastive_logsumexp
+
 SMALL_NUM = np.log(1e-45)
 class DCL(object):
     """
@@ -12,6 +14,7 @@ class DCL(object):
     def __init__(self, args):
         super(DCL, self).__init__()
         self.temperature = args.temperature
+        self.chunk_size = args.contrastive_chunk_size
 
     def __call__(self, z1, z2):
         """
@@ -20,9 +23,9 @@ class DCL(object):
         :param z2: second embedding vector
         :return: one-way loss
         """
-        cross_view_distance = torch.mm(z1, z2.t())
-        positive_loss = -torch.diag(cross_view_distance) / self.temperature
-        neg_similarity = torch.cat((torch.mm(z1, z1.t()), cross_view_distance), dim=1) / self.temperature
-        neg_mask = torch.eye(z1.size(0), device=z1.device).repeat(1, 2)
-        negative_loss = torch.logsumexp(neg_similarity + neg_mask * SMALL_NUM, dim=1, keepdim=False)
+        positive_loss = -(z1 * z2).sum(1) / self.temperature
+
+        # the negatives are the other samples of both views, z1_i . z1_i and z1_i . z2_i are masked out
+        negative_loss = contrastive_logsumexp(
+            z1, torch.cat((z1, z2)), self.temperature, offsets=(0, z1.size(0)), fill=SMALL_NUM, chunk_size=self.chunk_size)
         return (positive_loss + negative_loss).mean()
\ No newline at end of file
@@ -13,6 +13,8 @@ Adapted from
 import torch
 import torch.nn as nn
 
+from models.self_sup.simclr.loss.contrastive import contrastive_logsumexp
+
 class NTXentLoss(nn.Module):
     def __init__(self, args):
         super(NTXentLoss, self).__init__()
@@ -30,27 +32,16 @@ class NTXentLoss(nn.Module):
 
         b, n, dim = features.size()
         assert(n == 2)
-        mask = torch.eye(b, dtype=torch.float32).to(self.args.device)
 
         contrast_features = torch.cat(torch.unbind(features, dim=1), dim=0)
         anchor = features[:, 0]
 
-        # Dot product
-        dot_product = torch.matmul(anchor, contrast_features.T) / self.temperature
-        
-        # Log-sum trick for numerical stability
-        logits_max, _ = torch.max(dot_product, dim=1, keepdim=True)
-        logits = dot_product - logits_max.detach()
-
-        mask = mask.repeat(1, 2)
-        logits_mask = torch.scatter(torch.ones_like(mask), 1, torch.arange(b).view(-1, 1).cuda(), 0)
-        mask = mask * logits_mask
-
-        # Log-softmax
-        exp_logits = torch.exp(logits) * logits_mask
-        log_prob = logits - torch.log(exp_logits.sum(1, keepdim=True))
-        
+        # the positive of anchor i is the column b + i, the column i (the anchor itself) is left out of the softmax
+        positive = (anchor * features[:, 1]).sum(1) / self.temperature
+        log_normalizer = contrastive_logsumexp(
+            anchor, contrast_features, self.temperature, offsets=(0,), chunk_size=self.args.contrastive_chunk_size)
+
         # Mean log-likelihood for positive
-        loss = - ((mask * log_prob).sum(1) / mask.sum(1)).mean()
+        loss = - (positive - log_normalizer).mean()
 
         return loss
\ No newline at end of file
@@ -23,13 +23,14 @@ class SimCLR(nn.Module):
             nn.Linear(self.n_features, projection_dim, bias=False),
         )
 
-    def forward(self, x):
-        b, c, h, w = x.size()
-        x = torch.cat([x.unsqueeze(1), x.unsqueeze(1)], dim=1)
-        x = x.view(-1, c, h, w) 
-
-        x = x.cuda(non_blocking=True)
-
-        features = self.contrastive_head(self.backbone(x))
+    def forward(self, views):
+        """
+        views: the two augmented views [b, c, h, w] of the batch, as returned by TransformsSimCLR.
+        Both go through the backbone in a single [2b] pass, the features are returned as [b, 2, dim].
+        """
+        x1, x2 = views
+        b = x1.size(0)
+
+        features = self.contrastive_head(self.backbone(torch.cat((x1, x2))))
         features = F.normalize(features, dim = 1)
-        return features.view(b, 2, -1)
+        return features.view(2, b, -1).transpose(0, 1)
@@ -2,6 +2,7 @@ import time
 import utils.logger as logging
 from models.self_sup.simclr.loss.nt_xent_loss import NTXentLoss
 from optim.optimizer import load_optimizer
+from models.utils.grad_accumulation import get_accumulation_steps, grad_cache_step, group_batches
 from models.utils.commons import get_model_criterion, get_params, AverageMeter, get_params_to_update, prepare_model
 from models.utils.training_type_enum import TrainingType
 from utils.commons import load_chkpts, load_saved_state
@@ -38,21 +39,33 @@ class SimCLRTrainer():
 
         end = time.time()
 
-        for step, (inputs, _) in enumerate(self.train_loader):
+        # an optimizer step every accumulation_steps batches
+        accumulation_steps = get_accumulation_steps(self.args, self.train_params.batch_size)
+
+        for step, group in enumerate(group_batches(self.train_loader, accumulation_steps)):
             # Clear gradients w.r.t. parameters
             self.optimizer.zero_grad()
 
-            # image = image.to(self.args.device)
-            output = self.model(inputs)
-            loss = self.criterion(output)
+            group = [[view.to(self.args.device, non_blocking=True) for view in inputs] for inputs, _ in group]
+
+            if self.args.ssl_grad_cache:
+                # the negatives of every sample span the whole accumulated batch
+                loss = grad_cache_step(self.model, self.criterion, group, self.model)
+
+            else:
+                loss = 0
+                for inputs in group:
+                    output = self.model(inputs)
+                    micro_loss = self.criterion(output) / len(group)
 
-            # Getting gradients w.r.t. parameters
-            loss.backward()
+                    # Getting gradients w.r.t. parameters
+                    micro_loss.backward()
+                    loss += micro_loss.detach()
 
             # Updating parameters
             self.optimizer.step()
 
-            losses.update(loss.item(), inputs[0].size(0))
+            losses.update(loss.item(), sum(inputs[0].size(0) for inputs in group))
             batch_time.update(time.time() - end)
             end = time.time()
 
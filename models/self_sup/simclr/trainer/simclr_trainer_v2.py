@@ -1,8 +1,10 @@
 import time
+import torch
 from datautils.dataset_enum import DatasetType
 import utils.logger as logging
 from models.self_sup.simclr.loss.dcl_loss import DCL
 from optim.optimizer import load_optimizer
+from models.utils.grad_accumulation import get_accumulation_steps, grad_cache_step, group_batches
 from models.utils.commons import get_model_criterion, get_params, AverageMeter, get_params_to_update, prepare_model
 from models.utils.training_type_enum import TrainingType
 from utils.commons import load_chkpts, load_saved_state
@@ -34,6 +36,16 @@ class SimCLRTrainerV2():
         self.train_params = get_params(self.args, training_type)
         self.optimizer, self.scheduler = load_optimizer(self.args, params=params_to_update, train_params=self.train_params)
 
+    def project(self, inputs):
+        # Forward pass to get output/logits, both views in one pass, as [b, 2, dim]
+        _, output = self.model(torch.cat(inputs))
+        return output.view(2, inputs[0].size(0), -1).transpose(0, 1)
+
+    def symmetric_loss(self, output):
+        # Calculate Loss: softmax --> cross entropy loss
+        output1, output2 = output[:, 0], output[:, 1]
+        return self.criterion(output1, output2) + self.criterion(output2, output1)
+
     def train_epoch(self, epoch) -> int:
         batch_time = AverageMeter()
         data_time = AverageMeter()
@@ -44,26 +56,32 @@ class SimCLRTrainerV2():
         self.model.train()
         end = time.time()
 
-        for step, (inputs, _) in enumerate(self.train_loader):
+        # an optimizer step every accumulation_steps batches
+        accumulation_steps = get_accumulation_steps(self.args, self.train_params.batch_size)
+
+        for step, group in enumerate(group_batches(self.train_loader, accumulation_steps)):
             # Clear gradients w.r.t. parameters
             self.optimizer.zero_grad()
 
-            inputs = inputs.to(self.args.device)
+            group = [[view.to(self.args.device, non_blocking=True) for view in inputs] for inputs, _ in group]
 
-            # Forward pass to get output/logits
-            _, output1 = self.model(inputs)
-            _, output2 = self.model(inputs)
+            if self.args.ssl_grad_cache:
+                # the negatives of every sample span the whole accumulated batch
+                loss = grad_cache_step(self.project, self.symmetric_loss, group, self.model)
 
-            # Calculate Loss: softmax --> cross entropy loss
-            loss = self.criterion(output1, output2) + self.criterion(output2, output1)
+            else:
+                loss = 0
+                for inputs in group:
+                    micro_loss = self.symmetric_loss(self.project(inputs)) / len(group)
 
-            # Getting gradients w.r.t. parameters
-            loss.backward()
+                    # Getting gradients w.r.t. parameters
+                    micro_loss.backward()
+                    loss += micro_loss.detach()
 
             # Updating parameters
             self.optimizer.step()
 
-            losses.update(loss.item(), inputs[0].size(0))
+            losses.update(loss.item(), sum(inputs[0].size(0) for inputs in group))
             batch_time.update(time.time() - end)
             end = time.time()
 
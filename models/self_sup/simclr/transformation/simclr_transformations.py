@@ -45,5 +45,5 @@ class TransformsSimCLR():
         if not is_train:
             return self.test_transform(x)
 
-        # return self.train_transform(x), self.train_transform(x)
-        return self.train_transform(x)
\ No newline at end of file
+        # two independently augmented views of x, the positive pair
+        return self.train_transform(x), self.train_transform(x)
\ No newline at end of file
@@ -0,0 +1,79 @@
+import json
+import os
+
+import numpy as np
+import torch
+
+
+class FeatureQueue():
+    """
+    Ring buffer of the last `length` embeddings of every crop used for the assignments. A
+    batch overwrites the oldest rows at the write pointer instead of shifting the whole queue,
+    and the sinkhorn input reads the buffer in place: its row order does not matter since only
+    the assignments of the current batch, appended last, are kept.
+    """
+
+    def __init__(self, num_crops, length, feat_dim, device) -> None:
+        self.buffer = torch.zeros(num_crops, length, feat_dim, device=device)
+        self.length = length
+        self.ptr = 0
+        self.count = 0
+
+        # rows written since the last save, so that save only writes those
+        self.unsaved = 0
+
+    def is_full(self):
+        return self.count >= self.length
+
+    def push(self, embeddings):
+        """Writes the [num_crops, bs, feat_dim] embeddings over the oldest rows."""
+        bs = embeddings.size(1)
+        rows = (self.ptr + torch.arange(bs, device=self.buffer.device)) % self.length
+        self.buffer[:, rows] = embeddings
+
+        self.ptr = (self.ptr + bs) % self.length
+        self.count = min(self.count + bs, self.length)
+        self.unsaved = min(self.unsaved + bs, self.length)
+
+    def scores(self, prototypes):
+        """[num_crops, length, nmb_prototypes] prototype scores of the queued embeddings."""
+        return torch.matmul(self.buffer, prototypes.t())
+
+    def save(self, path):
+        """Writes the rows pushed since the last save into the memory-mapped queue at path."""
+        # a file left by a queue of another length or feature dim is written again from scratch
+        shape = tuple(self.buffer.shape)
+        if not os.path.isfile(path) or np.load(path, mmap_mode="r").shape != shape:
+            np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+            self.unsaved = self.length
+
+        data = np.load(path, mmap_mode="r+")
+        rows = (self.ptr - self.unsaved + np.arange(self.unsaved)) % self.length
+        data[:, rows] = self.buffer[:, torch.from_numpy(rows).to(self.buffer.device)].cpu().numpy()
+        data.flush()
+
+        # the pointer is written last, a crash before it only leaves newer rows in the file
+        tmp = f"{path}.json.tmp"
+        with open(tmp, "w") as file:
+            json.dump({"ptr": self.ptr, "count": self.count}, file)
+        os.replace(tmp, f"{path}.json")
+
+        self.unsaved = 0
+
+    @staticmethod
+    def load(path, device):
+        """Returns the queue saved at path, or None if there is none."""
+        try:
+            with open(f"{path}.json") as file:
+                meta = json.load(file)
+
+            data = np.load(path)
+
+        except IOError:
+            return None
+
+        queue = FeatureQueue(data.shape[0], data.shape[1], data.shape[2], device)
+        queue.buffer.copy_(torch.from_numpy(data))
+        queue.ptr, queue.count = meta["ptr"], meta["count"]
+
+        return queue
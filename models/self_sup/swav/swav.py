@@ -15,7 +15,9 @@ import os
 import time
 
 import numpy as np
+from models.self_sup.swav.queue import FeatureQueue
 from models.self_sup.swav.utils import initialize_exp
+from models.utils.grad_accumulation import get_accumulation_steps, get_steps_per_epoch, group_batches
 from models.utils.commons import get_params, AverageMeter, get_params_to_update, prepare_model
 from models.utils.training_type_enum import TrainingType
 from optim.optimizer import load_optimizer
@@ -56,12 +58,12 @@ class SwAVTrainer():
         )
 
         # build the queue
-        self.queue = None
-        self.queue_path = os.path.join(args.model_misc_path, "queue" + str(args.rank) + ".pth")
-        if os.path.isfile(self.queue_path):
-            self.queue = torch.load(self.queue_path)["queue"]
         # the queue needs to be divisible by the batch size
         self.args.queue_length -= args.queue_length % (args.swav_batch_size * args.world_size)
+        self.queue_path = os.path.join(args.model_misc_path, "queue" + str(args.rank) + ".npy")
+        self.queue = FeatureQueue.load(self.queue_path, self.args.device)
+        if self.queue is not None and self.queue.buffer.shape != (len(self.args.crops_for_assign), self.args.queue_length // self.args.world_size, self.args.feat_dim):
+            self.queue = None
 
         cudnn.benchmark = True
 
@@ -69,18 +71,21 @@ class SwAVTrainer():
 
         # optionally starts a queue
         if self.args.queue_length > 0 and epoch >= self.args.epoch_queue_starts and self.queue is None:
-            self.queue = torch.zeros(
+            self.queue = FeatureQueue(
                 len(self.args.crops_for_assign),
                 self.args.queue_length // self.args.world_size,
                 self.args.feat_dim,
-            ).cuda()
+                self.args.device,
+            )
 
         # train the network
         scores, self.queue = self.train(self.train_loader, epoch, self.queue)
         self.training_stats.update(scores)
 
+    def save_queue(self):
+        # called with save_state, so that a resumed run reads the queue of the weights it restores
         if self.queue is not None:
-            torch.save({"queue": self.queue}, self.queue_path)
+            self.queue.save(self.queue_path)
 
 
     def train(self, train_loader, epoch, queue):
@@ -91,59 +96,50 @@ class SwAVTrainer():
         self.model.train()
         use_the_queue = False
 
+        # an optimizer step every accumulation_steps batches, the learning rate schedule is per step
+        accumulation_steps = get_accumulation_steps(self.args, self.train_params.batch_size)
+        steps_per_epoch = get_steps_per_epoch(len(train_loader), accumulation_steps)
+
         end = time.time()
-        for it, inputs in enumerate(train_loader):
+        for it, group in enumerate(group_batches(train_loader, accumulation_steps)):
             # measure data loading time
             data_time.update(time.time() - end)
 
-            # update learning rate
-            iteration = epoch * len(train_loader) + it
+            # update learning rate, a streamed epoch can hold fewer batches than len(train_loader)
+            # but never more, the clamp only guards the last step of the schedule
+            iteration = min(epoch * steps_per_epoch + it, len(self.scheduler) - 1)
             for param_group in self.optimizer.param_groups:
                 param_group["lr"] = self.scheduler[iteration]
 
             # normalize the prototypes
             with torch.no_grad():
-                w = self.model.prototypes.weight.data.clone()
-                w = nn.functional.normalize(w, dim=1, p=2)
-                self.model.prototypes.weight.copy_(w)
-
-            # ============ multi-res forward passes ... ============
-            embedding, output = self.model(inputs)
-            embedding = embedding.detach()
-            bs = inputs[0].size(0)
+                w = self.model.prototypes.weight
+                w.div_(w.norm(dim=1, keepdim=True).clamp_min(1e-12))
 
-            # ============ swav loss ... ============
-            loss = 0
-            for i, crop_id in enumerate(self.args.crops_for_assign):
-                with torch.no_grad():
-                    out = output[bs * crop_id: bs * (crop_id + 1)].detach()
-
-                    # time to use the queue
-                    if queue is not None:
-                        if use_the_queue or not torch.all(queue[i, -1, :] == 0):
-                            use_the_queue = True
-                            out = torch.cat((torch.mm(
-                                queue[i],
-                                self.model.prototypes.weight.t()
-                            ), out))
-                        # fill the queue
-                        queue[i, bs:] = queue[i, :-bs].clone()
-                        queue[i, :bs] = embedding[crop_id * bs: (crop_id + 1) * bs]
-
-                    # get assignments
-                    q = self.distributed_sinkhorn(out)[-bs:]
-
-                # cluster assignment prediction
-                subloss = 0
-                for v in np.delete(np.arange(np.sum(self.args.nmb_crops)), crop_id):
-                    x = output[bs * v: bs * (v + 1)] / self.args.temperature
-                    subloss -= torch.mean(torch.sum(q * F.log_softmax(x, dim=1), dim=1))
-                loss += subloss / (np.sum(self.args.nmb_crops) - 1)
-            loss /= len(self.args.crops_for_assign)
-
-            # ============ backward and optim step ... ============
             self.optimizer.zero_grad()
-            loss.backward()
+            loss = 0
+            for inputs in group:
+                # ============ multi-res forward passes ... ============
+                embedding, output = self.model(inputs)
+                embedding = embedding.detach()
+                bs = inputs[0].size(0)
+
+                # ============ swav loss ... ============
+                # time to use the queue, once it has been filled
+                if queue is not None and queue.is_full():
+                    use_the_queue = True
+
+                micro_loss = self.swav_loss(output, bs, queue if use_the_queue else None) / len(group)
+
+                # fill the queue
+                if queue is not None:
+                    queue.push(torch.stack([embedding[crop_id * bs: (crop_id + 1) * bs] for crop_id in self.args.crops_for_assign]))
+
+                # ============ backward ... ============
+                micro_loss.backward()
+                loss += micro_loss.detach()
+
+            # ============ optim step ... ============
             # cancel gradients for the prototypes
             if iteration < self.args.freeze_prototypes_niters:
                 for name, p in self.model.named_parameters():
@@ -152,7 +148,7 @@ class SwAVTrainer():
             self.optimizer.step()
 
             # ============ misc ... ============
-            losses.update(loss.item(), inputs[0].size(0))
+            losses.update(loss.item(), sum(inputs[0].size(0) for inputs in group))
             batch_time.update(time.time() - end)
             end = time.time()
             if self.args.rank ==0 and it % self.log_step == 0:
@@ -173,25 +169,57 @@ class SwAVTrainer():
         return (epoch, losses.avg), queue
 
 
+    def swav_loss(self, output, bs, queue=None):
+        """
+        The swapped prediction loss of all the assigned crops at once: the assignments of the
+        crops are computed by a single batched sinkhorn, the log-softmax of every view by one
+        call, and the sum over the views other than the assigned crop by a mask.
+        """
+        crops_for_assign = self.args.crops_for_assign
+        nmb_views = int(np.sum(self.args.nmb_crops))
+
+        with torch.no_grad():
+            out = output.detach().view(nmb_views, bs, -1)[crops_for_assign]
+            if queue is not None:
+                out = torch.cat((queue.scores(self.model.prototypes.weight), out), dim=1)
+
+            # get assignments
+            q = self.distributed_sinkhorn(out)[:, -bs:]
+
+        # cluster assignment prediction
+        log_probs = F.log_softmax(output / self.args.temperature, dim=1).view(nmb_views, bs, -1)
+        cross_entropy = -torch.einsum("abk,vbk->av", q, log_probs) / bs
+
+        other_views = torch.ones_like(cross_entropy, dtype=torch.bool)
+        other_views[torch.arange(len(crops_for_assign)), torch.tensor(crops_for_assign)] = False
+
+        return (cross_entropy * other_views).sum() / ((nmb_views - 1) * len(crops_for_assign))
+
     @torch.no_grad()
     def distributed_sinkhorn(self, out):
-        Q = torch.exp(out / self.args.epsilon).t() # Q is K-by-B for consistency with notations from our paper
-        B = Q.shape[1] * self.args.world_size # number of samples to assign
-        K = Q.shape[0] # how many prototypes
+        # out is [B, K] or a stack of them [A, B, K], whose assignments are computed independently
+        Q = torch.exp(out / self.args.epsilon).transpose(-2, -1) # Q is K-by-B for consistency with notations from our paper
+        B = Q.shape[-1] * self.args.world_size # number of samples to assign
+        K = Q.shape[-2] # how many prototypes
 
         # make the matrix sums to 1
-        sum_Q = torch.sum(Q)
+        sum_Q = torch.sum(Q, dim=(-2, -1), keepdim=True)
         Q /= sum_Q
 
         for it in range(self.args.sinkhorn_iterations):
             # normalize each row: total weight per prototype must be 1/K
-            sum_of_rows = torch.sum(Q, dim=1, keepdim=True)
+            sum_of_rows = torch.sum(Q, dim=-1, keepdim=True)
+
+            # the columns are normalized at the end of every iteration, so the rows tell how far it is from converged
+            if self.args.sinkhorn_tolerance > 0 and it > 0 and torch.max(torch.abs(sum_of_rows * K - 1)) < self.args.sinkhorn_tolerance:
+                break
+
             Q /= sum_of_rows
             Q /= K
 
             # normalize each column: total weight per sample must be 1/B
-            Q /= torch.sum(Q, dim=0, keepdim=True)
+            Q /= torch.sum(Q, dim=-2, keepdim=True)
             Q /= B
 
         Q *= B # the colomns must sum to 1 so that Q is an assignment
-        return Q.t()
\ No newline at end of file
+        return Q.transpose(-2, -1)
\ No newline at end of file
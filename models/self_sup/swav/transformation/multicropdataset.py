@@ -8,12 +8,14 @@ Adapted from the SwAV repo
 # LICENSE file in the root directory of this source tree.
 #
 import random
+from functools import partial
 from typing import List
 
 from PIL import ImageFilter, Image
 import numpy as np
 import torchvision.datasets as datasets
 import torchvision.transforms as transforms
+from utils.commons import get_draft_size, pil_loader
 
 class MultiCropDataset(datasets.ImageFolder):
     def __init__(
@@ -38,7 +40,24 @@ class MultiCropDataset(datasets.ImageFolder):
             self.samples = self.samples[:size_dataset]
 
         self.return_index = return_index
+        self.loader = partial(pil_loader, size=get_draft_size(args, max(size_crops)))
 
+        self.trans = MultiCropTransform(size_crops, nmb_crops, min_scale_crops, max_scale_crops)
+
+    def __getitem__(self, index):
+        path, _ = self.samples[index]
+        image = self.loader(path)
+
+        multi_crops = self.trans(image)
+        if self.return_index:
+            return index, multi_crops
+        return multi_crops
+
+
+class MultiCropTransform():
+    """Returns the list of the nmb_crops[i] random crops of size size_crops[i] of an image"""
+
+    def __init__(self, size_crops, nmb_crops, min_scale_crops, max_scale_crops):
         color_transform = [get_color_distortion(), PILRandomGaussianBlur()]
         mean = [0.485, 0.456, 0.406]
         std = [0.228, 0.224, 0.225]
@@ -61,14 +80,8 @@ class MultiCropDataset(datasets.ImageFolder):
             ] * nmb_crops[i])
         self.trans = trans
 
-    def __getitem__(self, index):
-        path, _ = self.samples[index]
-        image = self.loader(path)
-
-        multi_crops = list(map(lambda trans: trans(image), self.trans))
-        if self.return_index:
-            return index, multi_crops
-        return multi_crops
+    def __call__(self, image):
+        return list(map(lambda trans: trans(image), self.trans))
 
 
 class PILRandomGaussianBlur(object):
@@ -3,21 +3,32 @@ Adapted from the SwAV repo
 '''
 
 import torch
-from models.self_sup.swav.transformation.multicropdataset import MultiCropDataset
+from datautils.shards import get_shard_dataset
+from models.self_sup.swav.transformation.multicropdataset import MultiCropDataset, MultiCropTransform
+from utils.commons import get_draft_size
 
 class TransformsSwAV():
     def __init__(self, args, batch_size, dir):
         
         # build data
-        self.train_dataset = MultiCropDataset(
+        self.train_dataset = get_shard_dataset(
             args,
-            dir,
-            args.size_crops,
-            args.nmb_crops,
-            args.min_scale_crops,
-            args.max_scale_crops,
+            MultiCropTransform(args.size_crops, args.nmb_crops, args.min_scale_crops, args.max_scale_crops),
+            with_label=False,
+            dir=dir,
+            draft_size=get_draft_size(args, max(args.size_crops)),
         )
 
+        if self.train_dataset is None:
+            self.train_dataset = MultiCropDataset(
+                args,
+                dir,
+                args.size_crops,
+                args.nmb_crops,
+                args.min_scale_crops,
+                args.max_scale_crops,
+            )
+
         self.train_loader = torch.utils.data.DataLoader(
             self.train_dataset,
             batch_size=batch_size,
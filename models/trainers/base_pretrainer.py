@@ -1,5 +1,5 @@
-import glob
-from datautils.path_loss import PathLoss
+from datautils.manifest import get_image_paths
+from datautils.path_loss import PathLossTable
 from models.active_learning.pretext_dataloader import PretextDataLoader
 from models.backbones.resnet import resnet_backbone
 from models.utils.training_type_enum import TrainingType
@@ -21,8 +21,8 @@ class BasePretrainer():
             train_loader = cifar10.CIFAR10(self.args, training_type=TrainingType.BASE_PRETRAIN).get_loader()
 
         else:
-            img_path = glob.glob(f'{self.args.dataset_dir}/{self.args.base_dataset}/*')            
-            pretrain_data = [PathLoss(path=sample, loss=0) for sample in img_path]
+            img_path = get_image_paths(f'{self.args.dataset_dir}/{self.args.base_dataset}/*', self.args.model_misc_path)
+            pretrain_data = PathLossTable.from_paths(img_path)
 
             train_loader = PretextDataLoader(self.args, pretrain_data, training_type=TrainingType.BASE_PRETRAIN).get_loader()
 
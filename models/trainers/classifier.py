@@ -2,7 +2,6 @@ import torch
 import torch.nn as nn
 from torch.optim.lr_scheduler import StepLR
 import time
-import copy
 import utils.logger as logging
 from datautils.dataset_enum import DatasetType, get_dataset_enum
 
@@ -13,7 +12,10 @@ from optim.optimizer import load_optimizer
 from models.utils.commons import accuracy, get_ds_num_classes, get_model_criterion, get_params, get_params_to_update, set_parameter_requires_grad
 from models.utils.training_type_enum import TrainingType
 from models.utils.early_stopping import EarlyStopping
-from utils.commons import get_accuracy_file_ext, load_chkpts, load_saved_state, save_accuracy_to_file, simple_save_model, simple_load_model
+from models.utils.feature_cache import FeatureCache
+from models.trainers.linear_sweep import LinearProbeSweep, save_sweep_results
+from utils.checkpointing import BestStateTracker
+from utils.commons import get_accuracy_file_ext, get_best_state_path, load_chkpts, load_saved_state, save_accuracy_to_file, simple_save_model, simple_load_model
 
 
 class Classifier:
@@ -48,7 +50,8 @@ class Classifier:
         train_params = get_params(self.args, TrainingType.LINEAR_CLASSIFIER)
         self.optimizer, self.scheduler = load_optimizer(self.args, params_to_update, state, train_params)
 
-        self.best_model = copy.deepcopy(self.model)
+        self.best_model = BestStateTracker(self.model, path=get_best_state_path(self.args, "classifier"))
+        self.best_model.update()
         self.best_acc = 0
 
     def train_and_eval(self, pretrain_data=None) -> None:
@@ -56,6 +59,15 @@ class Classifier:
             self.args, dir=self.dir, 
             training_type=TrainingType.LINEAR_CLASSIFIER).get_loader(pretrain_data=pretrain_data)
 
+        # the backbone is frozen, so with the feature cache it only runs once per split and view
+        # and the epochs train the fc head on the cached features
+        model = self.model
+        if self.args.lc_feature_cache:
+            feature_cache = FeatureCache(self.args)
+            train_loader = feature_cache.get_loader(self.model, train_loader, views=self.args.lc_feature_views, shuffle=True)
+            val_loader = feature_cache.get_loader(self.model, val_loader)
+            model = self.model.fc
+
         since = time.time()
 
         val_acc_history = []
@@ -73,11 +85,14 @@ class Classifier:
             logging.info('\nEpoch {}/{} lr: '.format(epoch, self.args.lc_epochs, lr))
             logging.info('-' * 10)
 
+            if self.args.lc_feature_cache:
+                train_loader.dataset.set_epoch(epoch)
+
             # train for one epoch
-            train_loss, train_acc = self.train_single_epoch(train_loader)
+            train_loss, train_acc = self.train_single_epoch(train_loader, model)
 
             # evaluate on validation set
-            val_loss, val_acc = self.validate(val_loader)
+            val_loss, val_acc = self.validate(val_loader, model)
             val_acc_history.append(str(val_acc))
 
             # Decay Learning Rate
@@ -103,15 +118,40 @@ class Classifier:
 
         return self.model, val_acc_history
 
-    def train_single_epoch(self, train_loader):
-        self.model.train()
+    def sweep(self, pretrain_data=None):
+        """Trains one linear head per configuration of the lc_sweep_* lists on the cached features."""
+        train_loader, val_loader = LCDataset(
+            self.args, dir=self.dir, 
+            training_type=TrainingType.LINEAR_CLASSIFIER).get_loader(pretrain_data=pretrain_data)
+
+        feature_cache = FeatureCache(self.args)
+        train_loader = feature_cache.get_loader(self.model, train_loader, views=self.args.lc_feature_views, shuffle=True)
+        val_loader = feature_cache.get_loader(self.model, val_loader)
+
+        sweep = LinearProbeSweep(self.args, self.model.fc.in_features, self.model.fc.out_features)
+        logging.info(f"Sweeping {len(sweep.configs)} linear heads on {get_dataset_enum(self.args.lc_dataset)}")
+
+        results = sweep.train_and_eval(train_loader, val_loader)
+        for result in results:
+            logging.info('lr: {lr} weight decay: {weight_decay} scheduler: {scheduler_type} Best Acc@1: {best_acc:.3f}'.format(**result))
+
+        additional_ext = get_accuracy_file_ext(self.args)
+        save_sweep_results(
+            self.args, results, 
+            filename=f"classifier_sweep_{get_dataset_enum(self.args.lc_dataset)}_batch_{self.args.lc_epochs}{additional_ext}.csv")
+
+        return results
+
+    def train_single_epoch(self, train_loader, model=None):
+        model = self.model if model is None else model
+        model.train()
 
         total_loss, corrects = 0.0, 0
         for step, (images, targets) in enumerate(train_loader):
             images, targets = images.to(self.args.device), targets.to(self.args.device)
 
             self.optimizer.zero_grad()
-            outputs = self.model(images)
+            outputs = model(images)
             loss = self.criterion(outputs, targets)
             _, preds = torch.max(outputs, 1)
 
@@ -132,8 +172,9 @@ class Classifier:
         return epoch_loss, epoch_acc
 
 
-    def validate(self, val_loader):    
-        self.model.eval()
+    def validate(self, val_loader, model=None):    
+        model = self.model if model is None else model
+        model.eval()
 
         total_loss, corrects = 0.0, 0
         with torch.no_grad():
@@ -142,7 +183,7 @@ class Classifier:
                 targets = targets.to(self.args.device)
 
                 # compute output
-                outputs = self.model(images)
+                outputs = model(images)
                 loss = self.criterion(outputs, targets)
                 _, preds = torch.max(outputs, 1)
 
@@ -156,10 +197,10 @@ class Classifier:
             epoch_loss, epoch_acc = accuracy(total_loss, corrects, val_loader)
             epoch_acc = epoch_acc * 100.0
 
-            # deep copy the model
+            # snapshot the weights of the model
             if epoch_acc > self.best_acc:
                 self.best_acc = epoch_acc
-                self.best_model = copy.deepcopy(self.model)
+                self.best_model.update(self.model)
 
             logging.info('Val Loss: {:.4f} Acc@1: {:.3f} Best Acc@1 so far: {:.3f}'.format(epoch_loss, epoch_acc, self.best_acc))
 
@@ -0,0 +1,161 @@
+import csv
+import itertools
+import math
+import os
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+import utils.logger as logging
+
+
+class MultiHeadLinear(nn.Module):
+    """H linear heads over the same features, evaluated with a single batched matmul."""
+
+    def __init__(self, num_heads, in_features, num_classes):
+        super(MultiHeadLinear, self).__init__()
+        self.weight = nn.Parameter(torch.empty(num_heads, num_classes, in_features).normal_(mean=0.0, std=0.01))
+        self.bias = nn.Parameter(torch.zeros(num_heads, num_classes))
+
+    def forward(self, x):
+        # [B, D] x [H, C, D] -> [H, B, C]
+        return torch.einsum("bd,hcd->hbc", x, self.weight) + self.bias.unsqueeze(1)
+
+
+class MultiHeadSGD():
+    """
+    SGD with momentum over the stacked heads, where every head has its own learning rate
+    and weight decay. It matches torch.optim.SGD applied to each head separately.
+    """
+
+    def __init__(self, params, lrs, weight_decays, momentum=0.9, nesterov=False):
+        self.params = list(params)
+        self.lrs = lrs
+        self.weight_decays = weight_decays
+        self.momentum = momentum
+        self.nesterov = nesterov
+        self.buffers = [None] * len(self.params)
+
+    def zero_grad(self):
+        for param in self.params:
+            param.grad = None
+
+    def per_head(self, values, param):
+        return values.view(-1, *([1] * (param.dim() - 1)))
+
+    @torch.no_grad()
+    def step(self):
+        for i, param in enumerate(self.params):
+            grad = param.grad + self.per_head(self.weight_decays, param) * param
+
+            if self.buffers[i] is None:
+                self.buffers[i] = grad.clone()
+            else:
+                self.buffers[i].mul_(self.momentum).add_(grad)
+
+            update = grad + self.momentum * self.buffers[i] if self.nesterov else self.buffers[i]
+            param.sub_(self.per_head(self.lrs, param) * update)
+
+
+def get_sweep_configs(args):
+    return [
+        {"lr": lr, "weight_decay": weight_decay, "scheduler_type": scheduler_type}
+        for lr, weight_decay, scheduler_type in itertools.product(
+            args.lc_sweep_lrs, args.lc_sweep_weight_decays, args.lc_sweep_schedulers)
+    ]
+
+
+def get_scheduled_lr(args, lr, scheduler_type, epoch, epochs):
+    # same values as the MultiStepLR and CosineAnnealingLR set up by load_optimizer for "Classifier"
+    if scheduler_type == "step":
+        return lr * args.lc_gamma ** sum(epoch >= milestone for milestone in args.decay_epochs)
+
+    elif scheduler_type == "cosine":
+        return args.lc_final_lr + (lr - args.lc_final_lr) * (1 + math.cos(math.pi * epoch / epochs)) / 2
+
+    raise ValueError(f"'{scheduler_type}' scheduler doesn't exist")
+
+
+class LinearProbeSweep():
+    """
+    Trains one linear head per hyperparameter configuration on the same batches of cached
+    features, and reports the best validation accuracy of every configuration.
+    """
+
+    def __init__(self, args, in_features, num_classes) -> None:
+        self.args = args
+        self.configs = get_sweep_configs(args)
+
+        self.heads = MultiHeadLinear(len(self.configs), in_features, num_classes).to(args.device)
+        self.weight_decays = torch.tensor([config["weight_decay"] for config in self.configs], device=args.device)
+        self.optimizer = MultiHeadSGD(
+            self.heads.parameters(), self.get_lrs(0), self.weight_decays,
+            momentum=args.momentum, nesterov=args.nesterov)
+
+        self.best_accs = torch.zeros(len(self.configs))
+
+    def get_lrs(self, epoch):
+        lrs = [get_scheduled_lr(self.args, config["lr"], config["scheduler_type"], epoch, self.args.lc_epochs) for config in self.configs]
+        return torch.tensor(lrs, device=self.args.device)
+
+    def train_single_epoch(self, train_loader):
+        total_loss = torch.zeros(len(self.configs), device=self.args.device)
+        for step, (features, targets) in enumerate(train_loader):
+            features, targets = features.to(self.args.device), targets.to(self.args.device)
+
+            self.optimizer.zero_grad()
+            outputs = self.heads(features)
+
+            # the heads don't share parameters, so summing their mean losses trains each one on its own
+            losses = F.cross_entropy(outputs.flatten(0, 1), targets.repeat(len(self.configs)), reduction="none").view(len(self.configs), -1).mean(dim=1)
+            losses.sum().backward()
+            self.optimizer.step()
+
+            total_loss += losses.detach() * features.size(0)
+
+        return total_loss / len(train_loader.dataset)
+
+    @torch.no_grad()
+    def validate(self, val_loader):
+        corrects = torch.zeros(len(self.configs), device=self.args.device)
+        for features, targets in val_loader:
+            features, targets = features.to(self.args.device), targets.to(self.args.device)
+
+            preds = self.heads(features).argmax(dim=2)
+            corrects += (preds == targets.unsqueeze(0)).sum(dim=1)
+
+        return (corrects / len(val_loader.dataset) * 100.0).cpu()
+
+    def train_and_eval(self, train_loader, val_loader):
+        for epoch in range(self.args.lc_epochs):
+            self.optimizer.lrs = self.get_lrs(epoch)
+            train_loader.dataset.set_epoch(epoch)
+
+            train_losses = self.train_single_epoch(train_loader)
+            val_accs = self.validate(val_loader)
+            self.best_accs = torch.maximum(self.best_accs, val_accs)
+
+            best = int(val_accs.argmax())
+            logging.info(f"Epoch {epoch}/{self.args.lc_epochs} Train Loss: {train_losses.mean().item():.4f} Best head: {self.configs[best]} Acc@1: {val_accs[best].item():.3f}")
+
+        return self.get_results()
+
+    def get_results(self):
+        results = [dict(config, best_acc=acc) for config, acc in zip(self.configs, self.best_accs.tolist())]
+        return sorted(results, key=lambda result: result["best_acc"], reverse=True)
+
+
+def save_sweep_results(args, results, filename):
+    out = os.path.join(args.model_misc_path, filename)
+
+    try:
+        with open(out, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=["lr", "weight_decay", "scheduler_type", "best_acc"])
+            writer.writeheader()
+            writer.writerows(results)
+
+        logging.info(f"Linear probe sweep results saved at {out}")
+
+    except IOError as er:
+        logging.error(er)
@@ -87,11 +87,18 @@ class SelfSupPretrainer(BasePretrainer):
                 lr = trainer.scheduler.get_last_lr()
 
             if epoch > 1 and epoch % epochs//2 == 0:
-                save_state(self.args, model, optimizer, pretrain_level, train_params.optimizer)
+                self.save_checkpoint(trainer, model, optimizer, pretrain_level, train_params.optimizer)
 
             self.args.current_epoch += 1
 
-        save_state(self.args, model, optimizer, pretrain_level, train_params.optimizer)
+        self.save_checkpoint(trainer, model, optimizer, pretrain_level, train_params.optimizer)
+
+    def save_checkpoint(self, trainer, model, optimizer, pretrain_level, optimizer_type):
+        save_state(self.args, model, optimizer, pretrain_level, optimizer_type)
+
+        # the SwAV queue is saved with the weights it was filled by
+        if hasattr(trainer, "save_queue"):
+            trainer.save_queue()
 
 
     def first_pretrain(self) -> None:
@@ -1,10 +1,12 @@
 import glob
+import zlib
 import torch.nn as nn
 import torch
 import torchvision
 from torch.utils.data import random_split
 import gc
 from datautils.dataset_enum import DatasetType
+from datautils.manifest import DEFAULT_CACHE_DIR, get_image_paths
 
 from models.self_sup.simclr.loss.dcl_loss import DCL
 from models.self_sup.simclr.loss.nt_xent_loss import NTXentLoss
@@ -119,7 +121,7 @@ def get_params(args, training_type):
             temperature=temperature
             ),
         TrainingType.BASE_PRETRAIN: Params(
-            batch_size=16, #32,#batch_size 
+            batch_size=args.base_pretrain_batch_size, #32,#batch_size 
             image_size=base_image_size, 
             lr=base_lr, 
             epochs=epochs,
@@ -173,6 +175,21 @@ def split_dataset2(dataset, ratio=0.6, is_classifier=False):
     return train_ds, val_ds
 
 
+def split_paths_by_hash(paths, ratio=0.7):
+    """
+    Train/val split of paths decided by a hash of each path instead of a random draw, so a
+    path stays on the same side when the list grows between AL batches.
+    """
+    train_paths, val_paths = [], []
+    for path in paths:
+        if zlib.crc32(path.encode("utf-8")) % 1000 < ratio * 1000:
+            train_paths.append(path)
+        else:
+            val_paths.append(path)
+
+    return train_paths, val_paths
+
+
 def get_ds_num_classes(dataset):
     if dataset == DatasetType.REAL.value:
         num_classes = 345
@@ -258,20 +275,20 @@ def prepare_model(args, trainingType, model):
 
     return model, params_to_update
 
-def get_images_pathlist(dir, with_train):
+def get_images_pathlist(dir, with_train, cache_dir=DEFAULT_CACHE_DIR):
     if dir == "./datasets/modern_office_31":
-        return glob.glob(dir + '/*/*/*')
+        return get_image_paths(dir + '/*/*/*', cache_dir)
 
     if "./datasets/generated" in dir.split('_'):
-        img_path = glob.glob(dir + '/*')
+        img_path = get_image_paths(dir + '/*', cache_dir)
 
     elif with_train:
         if dir in ["./datasets/imagenet", "./datasets/chest_xray"]:
-            img_path = glob.glob(dir + '/train/*/*')
+            img_path = get_image_paths(dir + '/train/*/*', cache_dir)
         else:
-            img_path = glob.glob(dir + '/train/*/*')
+            img_path = get_image_paths(dir + '/train/*/*', cache_dir)
     else:
-        img_path = glob.glob(dir + '/*/*')
+        img_path = get_image_paths(dir + '/*/*', cache_dir)
 
     return img_path
 
@@ -0,0 +1,231 @@
+import hashlib
+import os
+import shutil
+from typing import List
+
+import numpy as np
+import torch
+
+from datautils.image_store import get_image_source
+from datautils.manifest import decode_strings, encode_strings
+from models.utils.feature_cache import get_dataset_paths, get_state_hash
+from utils.commons import pil_loader
+import utils.logger as logging
+
+INDEX_FILE = "index.npz"
+
+
+class PathDataset(torch.utils.data.Dataset):
+    """Transformed images of a list of paths, read from the configured image source when possible."""
+
+    def __init__(self, args, paths: List[str], transform, draft_size=None) -> None:
+        self.paths = paths
+        self.transform = transform
+        self.draft_size = draft_size
+        self.image_source = get_image_source(args)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, idx):
+        path = self.paths[idx]
+        if self.image_source is not None and path in self.image_source:
+            img = self.image_source.load(path)
+        else:
+            img = pil_loader(path, self.draft_size)
+
+        return self.transform(img)
+
+
+class EmbeddingStore():
+    """
+    Outputs of a model (or of one of its layers) for images identified by their path, kept
+    as float16 memory-mapped chunks with a path index. A store is keyed by the hash of the
+    model weights, the transform, the JPEG draft size and the layer, so any call site
+    computing the same embeddings shares them. Paths missing from the store are computed and appended as a new
+    chunk, and the least recently used stores are deleted once embedding_store_max_gb is hit.
+    """
+
+    def __init__(self, args, model, transform, layer=None, draft_size=None) -> None:
+        self.args = args
+        self.model = model
+        self.transform = transform
+        self.layer = layer
+        self.draft_size = draft_size
+
+        key = "\n".join([get_state_hash(model), repr(transform), f"draft {draft_size}", layer or "output"])
+        self.root = args.embedding_store_dir
+        self.dir = os.path.join(self.root, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16])
+
+        self.paths, self.chunks, self.rows = [], np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64)
+        self.path_index = {}
+        self.chunk_data = {}
+
+        try:
+            with np.load(os.path.join(self.dir, INDEX_FILE)) as index:
+                self.paths = decode_strings(index["paths"])
+                self.chunks = index["chunks"]
+                self.rows = index["rows"]
+
+            self.path_index = {path: i for i, path in enumerate(self.paths)}
+
+        except IOError:
+            pass
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self.path_index
+
+    def get_chunk_file(self, chunk):
+        return os.path.join(self.dir, f"chunk-{str(chunk).zfill(5)}.npy")
+
+    def get_chunk(self, chunk):
+        if chunk not in self.chunk_data:
+            self.chunk_data[chunk] = np.load(self.get_chunk_file(chunk), mmap_mode="r")
+
+        return self.chunk_data[chunk]
+
+    @torch.no_grad()
+    def compute(self, paths):
+        loader = torch.utils.data.DataLoader(
+            PathDataset(self.args, paths, self.transform, self.draft_size),
+            batch_size=self.args.embedding_store_batch_size,
+            num_workers=self.args.workers,
+            shuffle=False,
+            pin_memory=True,
+        )
+
+        # "name" stores the output of the named module and "name:input" its input
+        captured = []
+        hook = None
+        if self.layer is not None:
+            name, _, part = self.layer.partition(":")
+            module = dict(self.model.named_modules())[name]
+            hook = module.register_forward_hook(lambda module, inputs, output: captured.append(inputs[0] if part == "input" else output))
+
+        was_training = self.model.training
+        self.model.eval()
+
+        chunk = int(self.chunks.max()) + 1 if len(self.chunks) > 0 else 0
+        data, start = None, 0
+        try:
+            for step, images in enumerate(loader):
+                outputs = self.model(images.to(self.args.device))
+                if hook is not None:
+                    outputs = captured.pop()
+
+                outputs = outputs.flatten(1).cpu().numpy().astype(np.float16)
+                if data is None:
+                    data = np.lib.format.open_memmap(
+                        self.get_chunk_file(chunk), mode="w+", dtype=np.float16, shape=(len(paths), outputs.shape[1]))
+
+                data[start: start + len(outputs)] = outputs
+                start += len(outputs)
+
+                if step % self.args.log_step == 0:
+                    logging.info(f"Embedding Step [{step}/{len(loader)}]")
+
+        finally:
+            if hook is not None:
+                hook.remove()
+
+            self.model.train(was_training)
+
+        data.flush()
+        return chunk
+
+    def fill(self, paths):
+        """Computes the embeddings of the paths that are not in the store yet."""
+        missing = list(dict.fromkeys(path for path in paths if path not in self.path_index))
+        if not missing:
+            return
+
+        os.makedirs(self.dir, exist_ok=True)
+        logging.info(f"Computing the embeddings of {len(missing)} new images into {self.dir}")
+
+        chunk = self.compute(missing)
+
+        self.path_index.update({path: len(self.paths) + i for i, path in enumerate(missing)})
+        self.paths = self.paths + missing
+        self.chunks = np.concatenate((self.chunks, np.full(len(missing), chunk, dtype=np.int32)))
+        self.rows = np.concatenate((self.rows, np.arange(len(missing), dtype=np.int64)))
+
+        # the index is replaced atomically, so an interrupted fill never points at a partial chunk
+        tmp = os.path.join(self.dir, "index.tmp.npz")
+        np.savez(tmp, paths=encode_strings(self.paths), chunks=self.chunks, rows=self.rows)
+        os.replace(tmp, os.path.join(self.dir, INDEX_FILE))
+
+        evict_stores(self.root, self.args.embedding_store_max_gb, keep=self.dir)
+
+    def get(self, paths):
+        """Returns the [len(paths), D] float16 embeddings of the paths, computing the missing ones."""
+        self.fill(paths)
+
+        # touching the index records the use of the store for the LRU eviction
+        os.utime(os.path.join(self.dir, INDEX_FILE))
+
+        indices = np.array([self.path_index[path] for path in paths], dtype=np.int64)
+        chunks, rows = self.chunks[indices], self.rows[indices]
+
+        embeddings = None
+        for chunk in np.unique(chunks):
+            mask = chunks == chunk
+            data = self.get_chunk(int(chunk))[np.sort(rows[mask])]
+
+            if embeddings is None:
+                embeddings = np.empty((len(paths), data.shape[1]), dtype=np.float16)
+
+            # the rows were read in sorted order for the memory map, put them back in the order of paths
+            embeddings[mask] = data[np.argsort(np.argsort(rows[mask]))]
+
+        return embeddings
+
+
+def get_dir_size(dir):
+    return sum(entry.stat().st_size for entry in os.scandir(dir) if entry.is_file())
+
+
+def evict_stores(root, max_gb, keep=None):
+    """Deletes the least recently used stores under root until they fit in max_gb."""
+    stores = []
+    for entry in os.scandir(root):
+        index = os.path.join(entry.path, INDEX_FILE)
+        if entry.is_dir() and os.path.exists(index):
+            stores.append((os.path.getmtime(index), entry.path, get_dir_size(entry.path)))
+
+    total = sum(size for _, _, size in stores)
+    for _, dir, size in sorted(stores):
+        if total <= max_gb * 1024 ** 3:
+            break
+
+        if dir == keep:
+            continue
+
+        shutil.rmtree(dir, ignore_errors=True)
+        total -= size
+        logging.info(f"Evicted the embedding store {dir} ({size / 1024 ** 2:.1f} MB)")
+
+
+def get_dataset_transform(dataset):
+    while isinstance(dataset, torch.utils.data.Subset):
+        dataset = dataset.dataset
+
+    return dataset.transform
+
+
+def get_dataset_draft_size(dataset):
+    while isinstance(dataset, torch.utils.data.Subset):
+        dataset = dataset.dataset
+
+    return getattr(dataset, "draft_size", None)
+
+
+def get_embeddings(args, model, paths, transform, layer=None, draft_size=None):
+    """
+    Embeddings of the paths as a float32 tensor, read from the shared store. draft_size has
+    to be the one the direct path decodes with, for the embeddings to match its outputs.
+    """
+    embeddings = EmbeddingStore(args, model, transform, layer, draft_size).get(paths)
+    return torch.from_numpy(embeddings.astype(np.float32))
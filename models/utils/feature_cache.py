@@ -0,0 +1,181 @@
+import hashlib
+import os
+from typing import List
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from datautils.path_loss import PathLossTable, get_sample_path
+import utils.logger as logging
+
+
+def get_state_hash(model, exclude=()):
+    """Hashes the weights and buffers of the model, leaving out the entries prefixed by exclude."""
+    digest = hashlib.sha1()
+    for name, tensor in sorted(model.state_dict().items()):
+        if name.startswith(tuple(exclude)):
+            continue
+
+        digest.update(name.encode("utf-8"))
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+
+    return digest.hexdigest()[:16]
+
+
+def get_backbone_hash(model):
+    # the features only depend on the weights below the fc head
+    return get_state_hash(model, exclude=("fc.",))
+
+
+def get_dataset_paths(dataset) -> List[str]:
+    """Paths of the images of a dataset, in the order of its indices."""
+    if isinstance(dataset, torch.utils.data.Subset):
+        paths = get_dataset_paths(dataset.dataset)
+        return [paths[i] for i in dataset.indices]
+
+    if isinstance(dataset, torch.utils.data.ConcatDataset):
+        return [path for child in dataset.datasets for path in get_dataset_paths(child)]
+
+    if hasattr(dataset, "img_path"):
+        return list(dataset.img_path)
+
+    if hasattr(dataset, "samples"):
+        return [path for path, _ in dataset.samples]
+
+    if hasattr(dataset, "store"):
+        return list(dataset.store.paths)
+
+    if hasattr(dataset, "pathloss_list"):
+        if isinstance(dataset.pathloss_list, PathLossTable):
+            return dataset.pathloss_list.paths()
+
+        return [get_sample_path(sample) for sample in dataset.pathloss_list]
+
+    raise ValueError(f"The paths of a {type(dataset).__name__} are unknown")
+
+
+def get_loader_key(loader):
+    """Describes the images a loader yields: the dataset, its image paths, the transform and the split indices."""
+    dataset, indices = loader.dataset, None
+    if isinstance(dataset, torch.utils.data.Subset):
+        dataset, indices = dataset.dataset, dataset.indices
+
+    description = [
+        type(dataset).__name__,
+        str(getattr(dataset, "root", getattr(dataset, "dir", ""))),
+        str(len(loader.dataset)),
+        repr(getattr(dataset, "transform", None)),
+    ]
+
+    digest = hashlib.sha1("\n".join(description).encode("utf-8"))
+    if indices is not None:
+        digest.update(np.asarray(indices, dtype=np.int64).tobytes())
+
+    # a dataset built from a list of paths has no root, two pools of the same size only differ by them
+    try:
+        digest.update("\n".join(get_dataset_paths(dataset)).encode("utf-8"))
+    except ValueError:
+        pass
+
+    return digest.hexdigest()[:16]
+
+
+class FeatureDataset(torch.utils.data.Dataset):
+    """
+    Batches of cached features and their labels. It is indexed with a list of indices, so
+    that the DataLoader reads a whole batch from the memory map at once. With several views
+    cached per image, set_epoch selects the view used by the epoch.
+    """
+
+    def __init__(self, features, labels) -> None:
+        self.features = features
+        self.labels = labels
+        self.view = 0
+
+    def __len__(self):
+        return self.features.shape[1]
+
+    def set_epoch(self, epoch):
+        self.view = epoch % self.features.shape[0]
+
+    def __getitem__(self, indices):
+        indices = np.sort(np.asarray(indices))
+        features = torch.from_numpy(self.features[self.view, indices].astype(np.float32))
+        labels = torch.from_numpy(self.labels[self.view, indices].astype(np.int64))
+
+        return features, labels
+
+
+class FeatureCache():
+    """
+    Backbone features of a frozen model, extracted once per split and kept as float16
+    memory-mapped files keyed by the hash of the backbone weights and of the loader.
+    """
+
+    def __init__(self, args, dir=None) -> None:
+        self.args = args
+        self.dir = dir if dir is not None else os.path.join(args.model_misc_path, "features")
+
+    def get_files(self, backbone_hash, loader_key, views):
+        name = f"{backbone_hash}_{loader_key}_{views}"
+        return os.path.join(self.dir, f"{name}_features.npy"), os.path.join(self.dir, f"{name}_labels.npy")
+
+    @torch.no_grad()
+    def extract(self, model, loader, views, features_file, labels_file):
+        # the fc head is swapped out so that the model returns the pooled features
+        fc = model.fc
+        model.fc = nn.Identity()
+        model.eval()
+
+        features, labels = None, None
+        try:
+            for view in range(views):
+                start = 0
+                for step, (images, targets) in enumerate(loader):
+                    outputs = model(images.to(self.args.device))
+
+                    if features is None:
+                        features = np.lib.format.open_memmap(
+                            features_file + ".tmp", mode="w+", dtype=np.float16,
+                            shape=(views, len(loader.dataset), outputs.size(1)))
+                        labels = np.empty((views, len(loader.dataset)), dtype=np.int64)
+
+                    features[view, start: start + outputs.size(0)] = outputs.cpu().numpy().astype(np.float16)
+                    labels[view, start: start + outputs.size(0)] = targets.numpy()
+                    start += outputs.size(0)
+
+                    if step % self.args.log_step == 0:
+                        logging.info(f"Feature extraction view {view + 1}/{views} Step [{step}/{len(loader)}]")
+
+        finally:
+            model.fc = fc
+
+        features.flush()
+        del features
+
+        np.save(labels_file, labels)
+        os.replace(features_file + ".tmp", features_file)
+
+    def get_loader(self, model, loader, views=1, shuffle=False):
+        """
+        Returns a loader over the cached features of the images of loader, extracting them
+        first if this backbone and split have not been cached yet.
+        """
+        os.makedirs(self.dir, exist_ok=True)
+        features_file, labels_file = self.get_files(get_backbone_hash(model), get_loader_key(loader), views)
+
+        if not (os.path.exists(features_file) and os.path.exists(labels_file)):
+            logging.info(f"Extracting {views} view(s) of the features of {len(loader.dataset)} images into {features_file}")
+            self.extract(model, loader, views, features_file, labels_file)
+        else:
+            logging.info(f"Using the cached features at {features_file}")
+
+        dataset = FeatureDataset(np.load(features_file, mmap_mode="r"), np.load(labels_file))
+
+        sampler = torch.utils.data.RandomSampler(dataset) if shuffle else torch.utils.data.SequentialSampler(dataset)
+        return torch.utils.data.DataLoader(
+            dataset,
+            sampler=torch.utils.data.BatchSampler(sampler, batch_size=loader.batch_size, drop_last=False),
+            batch_size=None,
+        )
@@ -6,6 +6,7 @@ from scipy.spatial.distance import cdist
 from datautils.dataset_enum import get_dataset_enum
 
 from models.gan5.operation import ImageFolder
+from models.utils.embedding_store import get_embeddings
 import utils.logger as logging
 
 def prepare_gen_dataset(args):
@@ -23,12 +24,15 @@ def prepare_gen_dataset(args):
     # Apply a pre-trained CNN to extract features from the images
     model = torchvision.models.resnet18(pretrained=True)
     model.eval()
-    features = []
-    with torch.no_grad():
-        for inputs, _ in dataloader:
-            outputs = model(inputs)
-            features.append(outputs)
-    features = torch.cat(features, dim=0)
+    if args.embedding_store:
+        features = get_embeddings(args, model, gen_dataset.frame + target.frame, data_transforms)
+    else:
+        features = []
+        with torch.no_grad():
+            for inputs, _ in dataloader:
+                outputs = model(inputs)
+                features.append(outputs)
+        features = torch.cat(features, dim=0)
 
     # Cluster the images using k-means
     kmeans = KMeans(n_clusters=1, random_state=0).fit(features.numpy())#5
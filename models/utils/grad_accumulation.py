@@ -0,0 +1,69 @@
+import contextlib
+import math
+
+import torch
+import torch.nn as nn
+
+
+def get_accumulation_steps(args, batch_size):
+    """Micro-batches accumulated per optimizer step to reach ssl_effective_batch_size. 1 if it is not set."""
+    if args.ssl_effective_batch_size <= batch_size:
+        return 1
+
+    return args.ssl_effective_batch_size // batch_size
+
+
+def get_steps_per_epoch(num_batches, accumulation_steps):
+    return math.ceil(num_batches / accumulation_steps)
+
+
+def group_batches(loader, accumulation_steps):
+    """Yields the batches of the loader in lists of accumulation_steps, the last one possibly shorter."""
+    group = []
+    for batch in loader:
+        group.append(batch)
+        if len(group) == accumulation_steps:
+            yield group
+            group = []
+
+    if group:
+        yield group
+
+
+@contextlib.contextmanager
+def frozen_norm_stats(model):
+    """Restores the running statistics of the batch norm layers of the model on exit."""
+    norms = [module for module in model.modules() if isinstance(module, nn.modules.batchnorm._BatchNorm) and module.track_running_stats]
+    saved = [(module.running_mean.clone(), module.running_var.clone(), module.num_batches_tracked.clone()) for module in norms]
+
+    try:
+        yield
+
+    finally:
+        for module, (mean, var, num_batches) in zip(norms, saved):
+            module.running_mean.copy_(mean)
+            module.running_var.copy_(var)
+            module.num_batches_tracked.copy_(num_batches)
+
+
+def grad_cache_step(model_fn, loss_fn, micro_batches, model):
+    """
+    Gradient cache (Gao et al., 2021) for a contrastive loss over a virtual batch: the
+    representations of every micro-batch are computed without a graph, the loss and its gradient
+    with respect to them are computed once over the whole virtual batch, so the negatives span
+    all of it, and each micro-batch is then forwarded again and backpropagates its slice of that
+    gradient. Only one micro-batch graph is alive at a time. The first pass still normalizes
+    with the batch statistics, but the batch norm running statistics of model are restored
+    after it, so they are updated once per sample, by the second pass, as in a plain step.
+    """
+    with torch.no_grad(), frozen_norm_stats(model):
+        reps = [model_fn(inputs) for inputs in micro_batches]
+
+    reps = [rep.detach().requires_grad_() for rep in reps]
+    loss = loss_fn(torch.cat(reps))
+    loss.backward()
+
+    for inputs, rep in zip(micro_batches, reps):
+        model_fn(inputs).backward(rep.grad)
+
+    return loss.detach()
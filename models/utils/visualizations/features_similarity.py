@@ -4,12 +4,15 @@ import torch
 import torch.optim as optim
 import torch.nn as nn
 import torch.nn.functional as F
+from torchvision.transforms import Compose
 
 from sklearn.manifold import TSNE
 import matplotlib.pyplot as plt
 from datautils.target_dataset import get_target_pretrain_ds
+from models.active_learning.rotation import NUM_ROTATIONS, Rotate, stack_rotations
 
 from models.backbones.resnet import resnet_backbone
+from models.utils.embedding_store import get_dataset_draft_size, get_dataset_paths, get_dataset_transform, get_embeddings
 from models.utils.commons import AverageMeter, get_model_criterion, get_params, prepare_model
 from models.utils.training_type_enum import TrainingType
 from optim.optimizer import load_optimizer
@@ -62,19 +65,12 @@ class FeatureSimilarity():
         for epoch in range(10):
             for step, (inputs, inputs1, inputs2, inputs3, targets, targets1, targets2, targets3) in enumerate(loader):
             
-                inputs, inputs1 = inputs.to(self.args.device), inputs1.to(self.args.device)
-                targets, targets1 = targets.to(self.args.device), targets1.to(self.args.device)
-                inputs2, inputs3 = inputs2.to(self.args.device), inputs3.to(self.args.device)
-                targets2, targets3 = targets2.to(self.args.device), targets3.to(self.args.device)
+                inputs, targets = stack_rotations((inputs, inputs1, inputs2, inputs3), (targets, targets1, targets2, targets3), self.args.device)
 
                 optimizer.zero_grad()
-                outputs, outputs1, outputs2, outputs3 = model(inputs), model(inputs1), model(inputs2), model(inputs3)
+                outputs = model(inputs)
 
-                loss = criterion(outputs, targets)
-                loss1 = criterion(outputs1, targets1)
-                loss2 = criterion(outputs2, targets2)
-                loss3 = criterion(outputs3, targets3)
-                loss_avg = (loss + loss1 + loss2 + loss3) / 4.
+                loss_avg = criterion(outputs, targets)
                 loss_avg.backward()
                 optimizer.step()
 
@@ -104,20 +100,24 @@ class FeatureSimilarity():
     def get_reps(self, model, loader):
         model.to(self.args.device)
 
+        if self.args.embedding_store:
+            # every rotation of the test view of an image is one entry of the shared store
+            paths = get_dataset_paths(loader.dataset)
+            test_transform = get_dataset_transform(loader.dataset).test_transform
+            draft_size = get_dataset_draft_size(loader.dataset)
+            return torch.cat([
+                get_embeddings(self.args, model, paths, Compose([test_transform, Rotate(k)]), draft_size=draft_size) for k in range(NUM_ROTATIONS)
+            ]).to(self.args.device)
+
         model.eval()
         latent_reps = []
 
         with torch.no_grad():
             for step, (inputs, inputs1, inputs2, inputs3, targets, targets1, targets2, targets3) in enumerate(loader):
-                inputs, inputs1, targets, targets1 = inputs.to(self.args.device), inputs1.to(self.args.device), targets.to(self.args.device), targets1.to(self.args.device)
-                inputs2, inputs3, targets2, targets3 = inputs2.to(self.args.device), inputs3.to(self.args.device), targets2.to(self.args.device), targets3.to(self.args.device)
-                
-                outputs = model(inputs)
-                outputs1 = model(inputs1)
-                outputs2 = model(inputs2)
-                outputs3 = model(inputs3)
+                inputs, targets = stack_rotations((inputs, inputs1, inputs2, inputs3), (targets, targets1, targets2, targets3), self.args.device)
 
-                outputs = torch.cat([outputs, outputs1, outputs2, outputs3], dim=0)
+                # the stacked batch keeps the rotation-major layout of the previous per-rotation concatenation
+                outputs = model(inputs)
                 latent_reps.append(outputs)
         return torch.cat(latent_reps, dim=0)
 
@@ -8,6 +8,7 @@ from PIL import Image
 
 from datautils.target_dataset import get_target_pretrain_ds
 from models.utils.training_type_enum import TrainingType
+from models.utils.embedding_store import get_dataset_paths, get_embeddings
 
 class FeatureSim():
     def __init__(self, args) -> None:
@@ -49,10 +50,13 @@ class FeatureSim():
         # Remove the last layer of the model to obtain feature vectors
         model = torch.nn.Sequential(*list(model.children())[:-1])
 
-        dataloader = self.get_loader()
+        if self.args.embedding_store:
+            features, labels = self.get_stored_features(model)
+        else:
+            dataloader = self.get_loader()
 
-        # Extract the features from the data using the pre-trained model
-        features, labels = self.extract_features(model, dataloader)
+            # Extract the features from the data using the pre-trained model
+            features, labels = self.extract_features(model, dataloader)
 
         nsamples, c, nx, ny = features.shape
         features = features.reshape((nsamples,c*nx*ny))
@@ -68,6 +72,22 @@ class FeatureSim():
         plt.savefig('tsne.png')
         # plt.show()
 
+    def get_stored_features(self, model):
+        # the same preprocessing as get_loader, read per path from the shared embedding store
+        transform = transforms.Compose([
+            transforms.Resize(28), 
+            transforms.ToTensor(), 
+            transforms.Normalize((0.5,), (0.5,))
+        ])
+
+        generated = get_dataset_paths(get_target_pretrain_ds(self.args, training_type=TrainingType.BASE_PRETRAIN).get_dataset(transform, is_tsne=True))
+        target = get_dataset_paths(get_target_pretrain_ds(self.args, training_type=TrainingType.ACTIVE_LEARNING).get_dataset(transform, is_tsne=True))
+
+        features = get_embeddings(self.args, model, generated + target, transform).numpy()
+        labels = np.array([0] * len(generated) + [1] * len(target))
+
+        return features.reshape(len(labels), -1, 1, 1), labels
+
     # Define a function to extract features from the data using a pre-trained model
     def extract_features(self, model, dataloader):
         features = []
@@ -4,6 +4,7 @@ import torch
 from torch.optim.lr_scheduler import CosineAnnealingLR
 from torch.optim import SGD, Adam
 
+from models.utils.grad_accumulation import get_accumulation_steps, get_steps_per_epoch
 from models.utils.training_type_enum import Params
 from .lars import LARS
 import utils.logger as logging
@@ -22,7 +23,7 @@ def load_optimizer(args, params, state=None, train_params: Params=None, train_lo
         scheduler = CosineAnnealingLR(optimizer, train_params.epochs, eta_min=0, T_max=200)
 
     elif train_params.optimizer == "DCL":
-        lr = train_params.lr * train_params.batch_size/256
+        lr = train_params.lr * train_params.batch_size * get_accumulation_steps(args, train_params.batch_size)/256
         optimizer = SGD(params, lr=lr, momentum=args.momentum, nesterov=True)
     
         scheduler = CosineAnnealingLR(optimizer, train_params.epochs, eta_min=0, T_max=200)
@@ -44,10 +45,12 @@ def load_optimizer(args, params, state=None, train_params: Params=None, train_lo
             weight_decay=args.weight_decay,
         )
         # optimizer = LARC(optimizer=optimizer, trust_coefficient=0.001, clip=False)
-        warmup_lr_schedule = np.linspace(args.start_warmup, train_params.lr, len(train_loader) * args.warmup_epochs)
-        iters = np.arange(len(train_loader) * (train_params.epochs - args.warmup_epochs))
+        # one learning rate per optimizer step, which is every accumulation_steps batches
+        steps_per_epoch = get_steps_per_epoch(len(train_loader), get_accumulation_steps(args, train_params.batch_size))
+        warmup_lr_schedule = np.linspace(args.start_warmup, train_params.lr, steps_per_epoch * args.warmup_epochs)
+        iters = np.arange(steps_per_epoch * (train_params.epochs - args.warmup_epochs))
         cosine_lr_schedule = np.array([args.final_lr + 0.5 * (train_params.lr - args.final_lr) * (1 + \
-                            math.cos(math.pi * t / (len(train_loader) * (train_params.epochs - args.warmup_epochs)))) for t in iters])
+                            math.cos(math.pi * t / (steps_per_epoch * (train_params.epochs - args.warmup_epochs)))) for t in iters])
         scheduler = np.concatenate((warmup_lr_schedule, cosine_lr_schedule))
 
     elif train_params.optimizer == "Classifier":
@@ -73,7 +76,7 @@ def load_optimizer(args, params, state=None, train_params: Params=None, train_lo
     elif train_params.optimizer == "LARS":
         # optimized using LARS with linear learning rate scaling
         # (i.e. LearningRate = 0.3 × BatchSize/256) and weight decay of 10−6.
-        lr = train_params.lr * train_params.batch_size/256
+        lr = train_params.lr * train_params.batch_size * get_accumulation_steps(args, train_params.batch_size)/256
         optimizer = LARS(
             params,
             lr=lr,
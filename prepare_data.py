@@ -1,4 +1,7 @@
 import argparse
+import glob
+import hashlib
+import os
 from io import BytesIO
 import multiprocessing
 from functools import partial
@@ -6,9 +9,11 @@ from functools import partial
 from PIL import Image
 import lmdb
 from tqdm import tqdm
-from torchvision import datasets
 from torchvision.transforms import functional as trans_fn
 
+from datautils.lmdb_dataset import get_image_key, get_label_key, get_path_key
+from datautils.manifest import get_manifest
+
 
 def resize_and_convert(img, size, resample, quality=100):
     img = trans_fn.resize(img, size, resample)
@@ -32,36 +37,107 @@ def resize_multiple(
     return imgs
 
 
-def resize_worker(img_file, sizes, resample):
-    i, file = img_file
-    img = Image.open(file)
-    img = img.convert("RGB")
-    out = resize_multiple(img, sizes=sizes, resample=resample)
+def resize_worker(file, sizes, resample):
+    try:
+        img = Image.open(file)
+        img = img.convert("RGB")
+
+    except (IOError, SyntaxError):
+        return None
+
+    return resize_multiple(img, sizes=sizes, resample=resample)
+
+
+def get_files(path, cache_dir):
+    """
+    Returns the (path, label) of every image under path, sorted by path. Both the class folder
+    layout of ImageFolder and the flat generated_* folders of the GAN stage (all labelled 0)
+    are supported.
+    """
+    flat = any(os.path.isfile(file) for file in glob.glob(os.path.join(path, "*")))
+    manifest = get_manifest(os.path.join(path, "*") if flat else os.path.join(path, "*", "*"), cache_dir)
+
+    if flat:
+        return [(file, 0) for file in manifest.paths]
 
-    return i, out
+    return list(zip(manifest.paths, manifest.labels.tolist()))
+
+
+def get_files_value(files):
+    # "count:hash" of the ordered file list a cursor is a position in
+    digest = hashlib.sha1("\n".join(f"{file}\t{label}" for file, label in files).encode("utf-8")).hexdigest()
+    return f"{len(files)}:{digest}".encode("utf-8")
+
+
+def read_int(txn, key, default=0):
+    value = txn.get(key.encode("utf-8"))
+    return default if value is None else int(value.decode("utf-8"))
 
 
 def prepare(
-    env, dataset, n_worker, sizes=(128, 256, 512, 1024), resample=Image.LANCZOS
+    env, files, n_worker, sizes=(40, 80, 90, 224), resample=Image.LANCZOS, batch_size=1000
 ):
+    """
+    Writes the images of files in order, committing one transaction every batch_size files.
+    "cursor" records how many files have been processed, so an interrupted run resumes
+    after the last commit instead of starting over. It is a position in files, so a run only
+    resumes over the same list of files, recorded as their count and a hash of their paths.
+    """
     resize_fn = partial(resize_worker, sizes=sizes, resample=resample)
+    sizes_value = ",".join(str(size) for size in sizes).encode("utf-8")
+    files_value = get_files_value(files)
+
+    with env.begin() as txn:
+        total = read_int(txn, "length")
+        cursor = read_int(txn, "cursor")
+        stored_sizes = txn.get("sizes".encode("utf-8"))
+        stored_files = txn.get("files".encode("utf-8"))
+
+    if cursor > 0:
+        if stored_sizes is not None and stored_sizes != sizes_value:
+            raise ValueError(f"The dataset was started with sizes {stored_sizes.decode('utf-8')}, not {sizes_value.decode('utf-8')}")
 
-    files = sorted(dataset.imgs, key=lambda x: x[0])
-    files = [(i, file) for i, (file, label) in enumerate(files)]
-    total = 0
+        if stored_files is not None and stored_files != files_value:
+            raise ValueError(
+                f"The dataset was started over {stored_files.decode('utf-8').split(':')[0]} files and the folder now has "
+                f"{len(files)} or different ones, resuming at file {cursor} would skip or duplicate images")
+
+        print(f"Resuming after {cursor} files ({total} images written)")
+
+    pending = files[cursor:]
 
     with multiprocessing.Pool(n_worker) as pool:
-        for i, imgs in tqdm(pool.imap_unordered(resize_fn, files)):
-            for size, img in zip(sizes, imgs):
-                key = f"{size}-{str(i).zfill(5)}".encode("utf-8")
+        txn = env.begin(write=True)
+        txn.put("sizes".encode("utf-8"), sizes_value)
+        txn.put("files".encode("utf-8"), files_value)
+
+        imgs_iter = pool.imap(resize_fn, [file for file, label in pending], chunksize=16)
+        for (file, label), imgs in tqdm(zip(pending, imgs_iter), total=len(pending)):
+            cursor += 1
+
+            if imgs is None:
+                print(f"Skipping {file}, it could not be decoded")
+
+            else:
+                for size, img in zip(sizes, imgs):
+                    txn.put(get_image_key(size, total), img)
+
+                # the label and the original path let the datasets look images up by path
+                txn.put(get_label_key(total), str(label).encode("utf-8"))
+                txn.put(get_path_key(total), file.encode("utf-8"))
+                total += 1
 
-                with env.begin(write=True) as txn:
-                    txn.put(key, img)
+            if cursor % batch_size == 0:
+                txn.put("length".encode("utf-8"), str(total).encode("utf-8"))
+                txn.put("cursor".encode("utf-8"), str(cursor).encode("utf-8"))
+                txn.commit()
+                txn = env.begin(write=True)
 
-            total += 1
+        txn.put("length".encode("utf-8"), str(total).encode("utf-8"))
+        txn.put("cursor".encode("utf-8"), str(cursor).encode("utf-8"))
+        txn.commit()
 
-        with env.begin(write=True) as txn:
-            txn.put("length".encode("utf-8"), str(total).encode("utf-8"))
+    print(f"{total} images written")
 
 
 if __name__ == "__main__":
@@ -70,7 +146,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "--size",
         type=str,
-        default="128,256,512,1024",
+        default="40,80,90,224",
         help="resolutions of images for the dataset",
     )
     parser.add_argument(
@@ -79,6 +155,18 @@ if __name__ == "__main__":
         default=8,
         help="number of workers for preparing dataset",
     )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=1000,
+        help="number of images written per transaction",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default="save/misc",
+        help="directory of the dataset manifests",
+    )
     parser.add_argument(
         "--resample",
         type=str,
@@ -96,7 +184,7 @@ if __name__ == "__main__":
 
     print(f"Make dataset of image sizes:", ", ".join(str(s) for s in sizes))
 
-    imgset = datasets.ImageFolder(args.path)
+    files = get_files(args.path, args.cache_dir)
 
     with lmdb.open(args.out, map_size=1024 ** 4, readahead=False) as env:
-        prepare(env, imgset, args.n_worker, sizes=sizes, resample=resample)
+        prepare(env, files, args.n_worker, sizes=sizes, resample=resample, batch_size=args.batch)
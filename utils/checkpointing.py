@@ -12,6 +12,7 @@ This handles saving and loading of checkpoints
 
 import copy
 import pathlib
+import threading
 from typing import Any, Dict, List, Optional
 
 # from loguru import logger
@@ -185,4 +186,83 @@ class CheckpointManager:
             #     f"Rank {rank}: Checkpointables not found in file: {not_loaded}"
             # )
             None
-        return iteration
\ No newline at end of file
+        return iteration
+
+
+class BestStateTracker:
+    r"""
+    Holds the weights of the best model seen so far as a CPU ``state_dict`` in
+    buffers allocated once, instead of a ``copy.deepcopy`` of the model on each
+    improvement. It can be passed anywhere a model is only used for its
+    ``state_dict`` (e.g. ``simple_save_model``).
+
+    Args:
+        model: Model whose ``state_dict`` is tracked.
+        path: If given, every snapshot is also written there by a background
+            thread. A new snapshot waits for the previous write to finish.
+    """
+
+    def __init__(self, model: nn.Module, path: Optional[str] = None):
+        self.model = model
+        self.path = path
+        self._buffers: Dict[str, torch.Tensor] = {}
+        self._writer: Optional[threading.Thread] = None
+
+    def _allocate(self, state_dict: Dict[str, torch.Tensor]):
+        pin_memory = torch.cuda.is_available()
+        self._buffers = {
+            key: torch.empty(value.shape, dtype=value.dtype, pin_memory=pin_memory)
+            for key, value in state_dict.items()
+        }
+
+    def update(self, model: Optional[nn.Module] = None):
+        r"""Snapshots the weights of ``model`` (the tracked one by default)."""
+
+        model = self.model if model is None else model
+        state_dict = model.state_dict()
+        self.wait()
+
+        # the buffers are reallocated only if the architecture changed
+        if state_dict.keys() != self._buffers.keys() or any(
+            value.shape != self._buffers[key].shape or value.dtype != self._buffers[key].dtype
+            for key, value in state_dict.items()
+        ):
+            self._allocate(state_dict)
+
+        for key, value in state_dict.items():
+            self._buffers[key].copy_(value.detach(), non_blocking=True)
+
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+        if self.path is not None:
+            self._writer = threading.Thread(target=self.save, args=(self.path,))
+            self._writer.start()
+
+    def state_dict(self) -> Dict[str, torch.Tensor]:
+        return self._buffers
+
+    def load_state_dict(self, state_dict: Dict[str, torch.Tensor]):
+        r"""Sets the snapshot to ``state_dict``, e.g. the best weights of a resumed run."""
+
+        self.wait()
+        self._allocate(state_dict)
+        for key, value in state_dict.items():
+            self._buffers[key].copy_(value)
+
+    def restore(self, model: Optional[nn.Module] = None):
+        r"""Loads the best weights back into ``model`` (the tracked one by default)."""
+
+        model = self.model if model is None else model
+        model.load_state_dict(self._buffers)
+        return model
+
+    def save(self, path: str):
+        torch.save({"model": self._buffers}, path)
+
+    def wait(self):
+        r"""Blocks until the background write of the last snapshot is done."""
+
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
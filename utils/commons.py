@@ -8,6 +8,7 @@ from models.active_learning.al_method_enum import get_al_method_enum
 
 from models.utils.ssl_method_enum import SSL_Method, get_ssl_method
 from datautils.dataset_enum import get_dataset_enum
+from datautils.path_loss import PathLossTable
 import utils.logger as logging
 
 
@@ -100,6 +101,10 @@ def simple_save_model(args, model, path):
     out = os.path.join(args.model_checkpoint_path, path)
     torch.save(state, out)
 
+def get_best_state_path(args, name):
+    # the path the best state tracker writes every new best to, if async_best_checkpoint is set
+    return os.path.join(args.model_checkpoint_path, f"{name}_best.pth") if args.async_best_checkpoint else None
+
 def simple_load_model(args, path):
     try:
         out = os.path.join(args.model_checkpoint_path, path)
@@ -129,13 +134,17 @@ def accuracy(pred, target, topk=1):
     return res[0] if return_single else res
 
 
-def save_path_loss(args, filename, image_loss_list):
+def get_path_loss_dir(args, filename):
+    # the table is a directory named after the file the pickled list used to be saved in
     filename = "{}_{}".format(get_dataset_enum(args.target_dataset), filename)
-    out = os.path.join(args.model_misc_path, filename)
+    return os.path.join(args.model_misc_path, os.path.splitext(filename)[0])
+
+
+def save_path_loss(args, filename, image_loss_list):
+    out = get_path_loss_dir(args, filename)
 
     try:
-        with open(out, "wb") as file:
-            pickle.dump(image_loss_list, file)
+        PathLossTable.from_samples(image_loss_list).save(out)
 
         logging.info(f"path loss saved at {out}")
 
@@ -145,12 +154,19 @@ def save_path_loss(args, filename, image_loss_list):
 
 
 def load_path_loss(args, filename):
+    try:
+        return PathLossTable.load(get_path_loss_dir(args, filename))
+
+    except IOError:
+        None
+
+    # lists pickled before the table existed
     filename = "{}_{}".format(get_dataset_enum(args.target_dataset), filename)
     out = os.path.join(args.model_misc_path, filename)
 
     try:
         with open(out, "rb") as file:
-            return pickle.load(file)
+            return PathLossTable.from_samples(pickle.load(file))
 
     except IOError as er:
         # logging.error(er)
@@ -188,35 +204,23 @@ def load_accuracy_file(args):
         # logging.error(er)
         return None
 
-def save_class_names(args, label):
-    filename = f"{get_dataset_enum(args.target_dataset)}.txt"
-    out = os.path.join(args.model_misc_path, filename)
-
-    try:
-        with open(out, "a") as file:
-            file.write(f"{str(label)}\n")
-
-    except IOError as er:
-        logging.error(er)
-        None
+def pil_loader(path, size=None):
+        # open path as file to avoid ResourceWarning (https://github.com/python-pillow/Pillow/issues/835)
+        with open(path, 'rb') as f:
+            return decode_image(f, size)
 
-def load_class_names(args):
-    filename = f"{get_dataset_enum(args.target_dataset)}.txt"
-    out = os.path.join(args.model_misc_path, filename)
+def decode_image(f, size=None):
+    img = Image.open(f)
 
-    try:
-        with open(out) as file:
-            return file.readlines()
+    # let libjpeg downscale in the DCT domain to the smallest scale that is still at least size x size.
+    # This is a no-op for PNG and the other formats, which are fully decoded
+    if size is not None and img.format == 'JPEG':
+        img.draft('RGB', (size, size))
 
-    except IOError as er:
-        logging.error(er)
-        return None
+    return img.convert('RGB')
 
-def pil_loader(path):
-        # open path as file to avoid ResourceWarning (https://github.com/python-pillow/Pillow/issues/835)
-        with open(path, 'rb') as f:
-            img = Image.open(f)
-            return img.convert('RGB')
+def get_draft_size(args, image_size):
+    return image_size if args.jpeg_draft_decode else None
 
 def get_accuracy_file_ext(args):
     if args.do_gradual_base_pretrain and args.base_pretrain: